@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+""" micro benchmarks over generated data, no api calls, no file changes """
+
+import argparse
+import random
+import sys
+from time import perf_counter
+
+from src.id_fix import MovieNameFix
+from src.trailers import FailedTrailers, TrailerHandler
+from src.tvsort import Static
+
+
+SHOWS = [
+    'The.Office.US', 'Doctor.Who.2005', 'Top Gear', 'The Daily Show',
+    'Planet.Earth.II', 'S.W.A.T.2017', 'Marvels.Agents.of.S.H.I.E.L.D',
+    'Greys Anatomy', 'Its.Always.Sunny.in.Philadelphia', 'Mr. Robot',
+    'The.Expanse', 'Last Week Tonight with John Oliver', 'Dark'
+]
+TAGS = [
+    '720p.HDTV.x264-CTU', '1080p.WEB-DL.DD5.1.H.264-NTb', 'HDTV XviD-LOL',
+    '2160p.AMZN.WEB-DL.DDP5.1.HDR.HEVC-NTb', 'REPACK.720p.WEB.h264-KOGi',
+    'PROPER.480p.x264-mSD', '1080p.BluRay.x264-DEMAND', 'WEBRip.x264-ION10'
+]
+EXT = ['.mkv', '.mp4', '.avi', '.m4v']
+YOUTUBE_CHARS = (
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'
+)
+
+
+def release_names(size, seed=1):
+    """ list of size release names in all id styles the parser knows """
+    rand = random.Random(seed)
+    names = []
+    for _ in range(size):
+        show = rand.choice(SHOWS)
+        sep = ' ' if ' ' in show else '.'
+        season = rand.randint(1, 30)
+        episode = rand.randint(1, 24)
+        style = rand.randrange(5)
+        if style == 0:
+            season_id = f'S{season:02d}E{episode:02d}'
+        elif style == 1:
+            season_id = f'S{season:02d}E{episode:02d}-E{episode + 1:02d}'
+        elif style == 2:
+            season_id = '.'.join([
+                str(rand.randint(1990, 2024)),
+                f'{rand.randint(1, 12):02d}', f'{rand.randint(1, 28):02d}'
+            ])
+        elif style == 3:
+            season_id = f'{season % 10}x{episode:02d}'
+        else:
+            season_id = f'S{season:02d}.E{episode:02d}'
+        names.append(
+            sep.join([show, season_id, rand.choice(TAGS)])
+            + rand.choice(EXT)
+        )
+    return names
+
+
+def bench_parse(size):
+    """ Static.parse_file_name and showname_encoder as used by Episode """
+    names = release_names(size)
+    start = perf_counter()
+    for name in names:
+        parsed = Static.parse_file_name(name)
+        Static.showname_encoder(parsed['showname'])
+    elapsed = perf_counter() - start
+    print(f'parse: {size} release names in {elapsed:.3f}s, '
+          f'{size / elapsed:.0f} names/s')
+
+
+def fake_trailers(size, seed=1):
+    """
+    remote, local trailer lists and ignore keys of a library with size
+    remote trailers, half already local, a tenth failed
+    """
+    rand = random.Random(seed)
+    remote = []
+    for i in range(size):
+        youtube_id = ''.join(rand.choices(YOUTUBE_CHARS, k=11))
+        movie_name = f'Movie {i // 2} ({rand.randint(1950, 2024)})'
+        remote.append({
+            'movie_name': movie_name,
+            'youtube_id': youtube_id,
+            'movie_folder': f'/movies/{movie_name}'
+        })
+    local = [
+        {'movie_name': i['movie_name'], 'youtube_id': i['youtube_id']}
+        for i in remote[::2]
+    ]
+    ignore = {
+        FailedTrailers.get_key(i['youtube_id'], i['movie_name'])
+        for i in remote[1::10]
+    }
+    return remote, local, ignore
+
+
+def bench_trailers(size):
+    """ TrailerHandler.diff_pending at a hundredth, tenth and full size """
+    for step in (size // 100, size // 10, size):
+        remote, local, ignore = fake_trailers(step)
+        start = perf_counter()
+        pending = TrailerHandler.diff_pending(remote, local, ignore)
+        elapsed = perf_counter() - start
+        print(f'trailers: {step} remote, {len(pending)} pending in '
+              f'{elapsed:.3f}s, {elapsed / step * 1000000:.2f}us per trailer')
+
+
+def fake_movies(size, seed=1):
+    """
+    emby movie items of a library with size movies, a few with a
+    different name or premiere date than in their filename
+    """
+    rand = random.Random(seed)
+    movies = []
+    for i in range(size):
+        name = f'{rand.choice(SHOWS).replace(".", " ")} {i}'
+        if rand.random() < 0.1:
+            # filename has - for /
+            name = name.replace(' ', '/', 1)
+        year = rand.randint(1950, 2024)
+        file_name = name.replace('/', '-')
+        if rand.random() < 0.02:
+            file_name = file_name + ' Extended'
+        movie = {
+            'Name': name,
+            'Path': f'/movies/{year}/{file_name} ({year})/'
+                    f'{file_name} ({year}){rand.choice(EXT)}'
+        }
+        if rand.random() < 0.98:
+            premiere = year + 1 if rand.random() < 0.02 else year
+            movie['PremiereDate'] = f'{premiere}-01-01T00:00:00.0000000Z'
+        movies.append(movie)
+    return movies
+
+
+def bench_names(size):
+    """ MovieNameFix.find_errors over the whole library """
+    movies = fake_movies(size)
+    start = perf_counter()
+    errors = MovieNameFix.find_errors(movies)
+    elapsed = perf_counter() - start
+    print(f'names: {size} movies, {len(errors)} errors in {elapsed:.3f}s, '
+          f'{elapsed / size * 1000000:.2f}us per movie')
+
+
+BENCHMARKS = {
+    'parse': (bench_parse, 10000),
+    'trailers': (bench_trailers, 100000),
+    'names': (bench_names, 50000)
+}
+
+
+def main(argv=None):
+    """ run benchmark """
+    parser = argparse.ArgumentParser(
+        prog='benchmark', description='measure throughput of hot paths'
+    )
+    parser.add_argument('benchmark', choices=list(BENCHMARKS.keys()))
+    parser.add_argument(
+        '--size', type=int, help='number of generated items'
+    )
+    args = parser.parse_args(argv)
+    bench_func, default_size = BENCHMARKS[args.benchmark]
+    bench_func(args.size or default_size)
+    return 0
+
+
+# start here
+if __name__ == "__main__":
+    sys.exit(main())
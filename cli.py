@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" command line interface to run the tasks without the curses menu """
+
+import argparse
+import json
+import logging
+import sys
+from contextlib import redirect_stdout
+from os import path
+
+from src.config import get_config
+from src.batch import Batch
+from src.watcher import Daemon
+
+from src import tvsort
+from src import moviesort
+from src import db_export
+from src import trailers
+from src import id_fix
+
+
+TASKS = {
+    'sort-movies': moviesort.main,
+    'sort-tv': tvsort.main,
+    'trailers': trailers.main,
+    'fix-names': id_fix.main,
+    'export': db_export.main
+}
+
+
+def get_tasks(task, config):
+    """ list of tasks to run, all based on availabe keys in config file """
+    if task != 'all':
+        return [task]
+    tasks = ['sort-movies', 'sort-tv']
+    if 'ydl_opts' in config.keys():
+        tasks.append('trailers')
+    if 'emby' in config.keys():
+        tasks.extend(['fix-names', 'export'])
+    return tasks
+
+
+def parse_args(argv=None):
+    """ build the parser and parse argv """
+    parser = argparse.ArgumentParser(
+        prog='media_organizer',
+        description='run media_organizer tasks, '
+                    'prints a json summary to stdout when done'
+    )
+    parser.add_argument(
+        'task', choices=['all', 'watch'] + list(TASKS.keys()),
+        help='watch: keep running and sort new downloads once complete'
+    )
+    parser.add_argument(
+        '-y', '--yes', action='store_true',
+        help='accept the default answer of all confirm prompts'
+    )
+    parser.add_argument(
+        '--on-ambiguous', choices=Batch.ON_AMBIGUOUS, default='ask',
+        help='ask: prompt as usual, defer: add to review.json in log_folder'
+             ' and skip, best: take the highest score'
+    )
+    parser.add_argument(
+        '--interval', type=int, default=10,
+        help='watch: max seconds between rescans of the download folders'
+    )
+    parser.add_argument(
+        '--settle', type=int, default=60,
+        help='watch: seconds a download has to stay unchanged'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ run tasks, return exit code """
+    # pylint: disable=broad-except
+    args = parse_args(argv)
+    config = get_config()
+    log_file = path.join(config['media']['log_folder'], 'rename.log')
+    logging.basicConfig(
+        filename=log_file, level=logging.INFO, format='%(asctime)s:%(message)s'
+    )
+    if args.task == 'watch':
+        # nobody there to ask
+        on_ambiguous = 'best' if args.on_ambiguous == 'best' else 'defer'
+        Batch.setup(yes=True, on_ambiguous=on_ambiguous)
+        Daemon(interval=args.interval, settle=args.settle).run()
+        return 0
+    Batch.setup(yes=args.yes, on_ambiguous=args.on_ambiguous)
+    summary = {'task': args.task, 'results': {}, 'errors': {}}
+    # keep stdout for the summary
+    with redirect_stdout(sys.stderr):
+        for task in get_tasks(args.task, config):
+            try:
+                summary['results'][task] = TASKS[task]()
+            except Exception as err:
+                logging.exception('cli:%s failed', task)
+                summary['errors'][task] = repr(err)
+    summary['deferred'] = len(Batch.deferred)
+    summary['review_file'] = Batch.write_review() if Batch.deferred else None
+    print(json.dumps(summary))
+    return 1 if summary['errors'] else 0
+
+
+# start here
+if __name__ == "__main__":
+    sys.exit(main())
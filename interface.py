@@ -3,9 +3,12 @@
 
 import curses
 import logging
+import threading
+from datetime import datetime
 from os import path
 from time import sleep
 
+from src.api_client import ApiClient
 from src.config import get_config
 
 from src import tvsort
@@ -28,29 +31,93 @@ class Interface:
     def __init__(self):
         self.menu = self.build_menu()
         self.stdscr = None
-        self.menu_item = 0
-        self.pending = self.get_pending_all()
+        # key: last known count, kept while refreshing
+        self.pending = {}
+        self.updated = None
+        # key: running thread
+        self.refreshing = {}
+        self.lock = threading.Lock()
+        # redraw menu on next key timeout
+        self.changed = threading.Event()
+        self.get_pending_all()
 
-    def get_pending_all(self):
-        """ figure out what needs to be done """
-        # call subfunction to collect pending
-        pending = {}
-        pending_movie = moviesort.MovieHandler().pending
-        pending_tv = tvsort.TvHandler().pending
-        pending['movies'] = pending_movie
-        pending['tv'] = pending_tv
+    def get_probes(self):
+        """ functions returning the pending count, by key """
+        probes = {
+            'movies': lambda: moviesort.MovieHandler().pending,
+            'tv': lambda: tvsort.TvHandler().pending
+        }
         # based on config key
         if 'emby' in self.CONFIG.keys():
-            pending_trailer = len(trailers.TrailerHandler().pending)
-            pending_movie_fix = len(id_fix.MovieNameFix().pending)
-            pending['trailer'] = pending_trailer
-            pending['movie_fix'] = pending_movie_fix
-            pending_total = (pending_movie + pending_tv +
-                             pending_trailer + pending_movie_fix)
-        else:
-            pending_total = pending_movie + pending_tv
-        pending['total'] = pending_total
-        return pending
+            probes['trailer'] = lambda: len(
+                trailers.TrailerHandler().pending
+            )
+            probes['movie_fix'] = lambda: len(id_fix.MovieNameFix().pending)
+        return probes
+
+    def get_pending_all(self):
+        """ figure out what needs to be done in background threads """
+        to_start = []
+        with self.lock:
+            for key, probe in self.get_probes().items():
+                if key in self.refreshing:
+                    continue
+                thread = threading.Thread(
+                    target=self.run_probe, args=(key, probe), daemon=True
+                )
+                self.refreshing[key] = thread
+                to_start.append(thread)
+        for thread in to_start:
+            thread.start()
+
+    def run_probe(self, key, probe):
+        """ store result of single probe, keep last known on error """
+        # pylint: disable=broad-except
+        # don't print over the menu
+        ApiClient.QUIET.enabled = True
+        try:
+            count = probe()
+        except Exception:
+            logging.exception('interface:pending %s failed', key)
+            count = None
+        with self.lock:
+            if count is not None:
+                self.pending[key] = count
+            self.refreshing.pop(key)
+            if not self.refreshing:
+                self.updated = datetime.now()
+        self.changed.set()
+
+    def wait_for_probes(self):
+        """ let running probes finish before a task changes things """
+        with self.lock:
+            running = list(self.refreshing.values())
+        if running:
+            print('waiting for pending counts...')
+        for thread in running:
+            thread.join()
+
+    def get_count(self, key):
+        """ count to show in menu, ? if not known yet """
+        with self.lock:
+            if key == 'total':
+                keys = self.get_probes().keys()
+                if not all(i in self.pending for i in keys):
+                    return '?'
+                return sum(self.pending[i] for i in keys)
+            return self.pending.get(key, '?')
+
+    def get_status(self):
+        """ last refresh time and if refresh is running """
+        with self.lock:
+            refreshing = bool(self.refreshing)
+            updated = self.updated
+        status = 'r: refresh'
+        if updated:
+            status = f'{status}, updated {updated.strftime("%H:%M:%S")}'
+        if refreshing:
+            status = f'{status}, refreshing...'
+        return status
 
     def build_menu(self):
         """ build the menu based on availabe keys in config file """
@@ -69,9 +136,10 @@ class Interface:
         while True:
             menu_item = curses.wrapper(self.curses_main)
             if menu_item != 'Exit':
+                self.wait_for_probes()
                 self.sel_handler(menu_item)
                 sleep(3)
-                self.pending = self.get_pending_all()
+                self.get_pending_all()
             else:
                 return
 
@@ -89,11 +157,18 @@ class Interface:
         curses.init_pair(1, curses.COLOR_BLUE, curses.COLOR_WHITE)
         current_row_idx = 0
         self.print_menu(current_row_idx)
+        # wake up to show counts as they come in
+        stdscr.timeout(500)
         # endless loop
         while True:
             # wait for exit signal
             try:
                 key = stdscr.getch()
+                if key == -1:
+                    if self.changed.is_set():
+                        self.changed.clear()
+                        self.print_menu(current_row_idx)
+                    continue
                 stdscr.clear()
                 # react to kee press
                 last = len(self.menu) - 1
@@ -113,12 +188,7 @@ class Interface:
                 elif key == ord('q'):
                     return 'Exit'
                 elif key == ord('r'):
-                    message = 'refreshing pending'
-                    h, w = self.center_message(message)
-                    stdscr.addstr(h, w, message)
-                    self.pending = self.get_pending_all()
-                    stdscr.refresh()
-                    sleep(1)
+                    self.get_pending_all()
                 # print
                 self.print_menu(current_row_idx)
                 stdscr.refresh()
@@ -155,7 +225,7 @@ class Interface:
         message = 'github.com/bbilly1/media_organizer'
         _, w = self.center_message(message)
         self.stdscr.addstr(max_h - 1, w, message)
-        message = 'q: quit, r: refresh'
+        message = f'q: quit, {self.get_status()}'
         _, w = self.center_message(message)
         self.stdscr.addstr(max_h - 2, w, message)
         # build stdscr
@@ -167,15 +237,15 @@ class Interface:
         for idx, row in enumerate(self.menu):
             # menu items count
             if row == 'All':
-                pending_count = self.pending['total']
+                pending_count = self.get_count('total')
             elif row == 'Movies':
-                pending_count = self.pending['movies']
+                pending_count = self.get_count('movies')
             elif row == 'TV shows':
-                pending_count = self.pending['tv']
+                pending_count = self.get_count('tv')
             elif row == 'Trailer download':
-                pending_count = self.pending['trailer']
+                pending_count = self.get_count('trailer')
             elif row == 'Fix Movie Names':
-                pending_count = self.pending['movie_fix']
+                pending_count = self.get_count('movie_fix')
             else:
                 pending_count = ' '
             # center whole
@@ -0,0 +1,113 @@
+""" shared http clients, one keep-alive session per upstream api """
+
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import sleep
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import get_config
+from src.rate_limit import TokenBucket
+
+
+class ApiClient:
+    """ pooled session with timeout, retry and concurrency limit """
+
+    CONFIG = get_config()
+    RETRIES = 5
+    MAX_BACK_OFF = 60
+    # worth trying again
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    # threads with QUIET.enabled log retries instead of printing them
+    QUIET = threading.local()
+
+    def __init__(self, headers=None, max_connections=4, rate_limit=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max_connections
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self.semaphore = threading.BoundedSemaphore(max_connections)
+        self.rate_limit = rate_limit
+        read_timeout = self.CONFIG['media'].get('request_timeout', 60)
+        self.timeout = (10, read_timeout)
+
+    def get(self, url, **kwargs):
+        """ get url, retry on connection errors and retryable status """
+        # query can hold api keys, keep it out of the output
+        parsed = urlsplit(url)
+        host = parsed.netloc
+        for i in range(self.RETRIES):
+            if self.rate_limit:
+                self.rate_limit.acquire()
+            try:
+                with self.semaphore:
+                    response = self.session.get(
+                        url, timeout=self.timeout, **kwargs
+                    )
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if i == self.RETRIES - 1:
+                    raise
+                self.report(f'connection to {host} failed, retrying')
+                sleep((i + 1) ** 2)
+                continue
+            if response.ok or response.status_code not in self.RETRY_STATUS:
+                return response
+            if response.status_code == 429:
+                self.report(f'hit {host} rate limiting, slowing down')
+            else:
+                self.report(f'request to {host}{parsed.path} failed with '
+                            f'status {response.status_code}')
+            if i < self.RETRIES - 1:
+                sleep(self.get_back_off(response, i))
+        return response
+
+    def report(self, message):
+        """ print message, only log it in quiet threads """
+        if getattr(self.QUIET, 'enabled', False):
+            logging.warning('api:%s', message)
+        else:
+            print(message)
+
+    def get_json(self, url, **kwargs):
+        """ get url and return parsed json """
+        response = self.get(url, **kwargs)
+        return response.json()
+
+    def get_back_off(self, response, attempt):
+        """ seconds to wait, Retry-After header if set, else quadratic """
+        retry_after = response.headers.get('Retry-After')
+        back_off = (attempt + 1) ** 2
+        if retry_after:
+            try:
+                back_off = float(retry_after)
+            except ValueError:
+                try:
+                    retry_date = parsedate_to_datetime(retry_after)
+                    now = datetime.now(timezone.utc)
+                    back_off = (retry_date - now).total_seconds()
+                except (TypeError, ValueError):
+                    pass
+        return min(max(back_off, 0), self.MAX_BACK_OFF)
+
+
+USER_AGENT = {'User-Agent': 'https://github.com/bbilly1/media_organizer'}
+# tvmaze allows 20 calls every 10 seconds,
+# worst case in any 10 seconds is capacity + 10 * rate
+TVMAZE = ApiClient(
+    headers=USER_AGENT, max_connections=4,
+    rate_limit=TokenBucket(capacity=10, rate=1)
+)
+TMDB = ApiClient(
+    headers=USER_AGENT, max_connections=4,
+    rate_limit=TokenBucket(capacity=40, rate=20)
+)
+EMBY = ApiClient(max_connections=2)
@@ -0,0 +1,11 @@
+""" replace files without ever leaving a partial one behind """
+
+import os
+
+
+def write_atomic(file_path, content):
+    """ write content to a tmp file next to file_path, then replace it """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,81 @@
+""" settings and review queue for unattended runs """
+
+import json
+import os
+from datetime import datetime
+
+from src.atomic_file import write_atomic
+from src.config import get_config
+
+
+class Deferred(Exception):
+    """ item needs manual review, skip it for this run """
+
+
+class Batch:
+    """ shared by all handlers, interactive unless set up by the cli """
+
+    CONFIG = get_config()
+    # ask: prompt, defer: add to review queue, best: take highest score
+    ON_AMBIGUOUS = ('ask', 'defer', 'best')
+    yes = False
+    on_ambiguous = 'ask'
+    deferred = []
+
+    @classmethod
+    def setup(cls, yes=False, on_ambiguous='ask'):
+        """ set up unattended run """
+        if on_ambiguous not in cls.ON_AMBIGUOUS:
+            raise ValueError(f'invalid on_ambiguous: {on_ambiguous}')
+        cls.yes = yes
+        cls.on_ambiguous = on_ambiguous
+        cls.deferred = []
+
+    @classmethod
+    def confirm(cls, message):
+        """ input() replacement, accepts the default if yes is set """
+        if cls.yes:
+            return ''
+        return input(message)
+
+    @classmethod
+    def ambiguous(cls, kind, filename, candidates, scores):
+        """
+        return index of candidate to use, None to prompt as usual
+        or raise Deferred after adding to review queue
+        """
+        if cls.on_ambiguous == 'best' and scores:
+            return max(range(len(scores)), key=lambda i: scores[i])
+        if cls.on_ambiguous in ('defer', 'best'):
+            cls.defer(kind, filename, 'ambiguous match', candidates)
+            raise Deferred(filename)
+        return None
+
+    @classmethod
+    def defer(cls, kind, filename, reason, candidates=None):
+        """ add item to review queue """
+        item = {
+            'kind': kind,
+            'filename': filename,
+            'reason': reason,
+            'candidates': candidates or [],
+            'date': datetime.now().isoformat(timespec='seconds')
+        }
+        cls.deferred.append(item)
+
+    @classmethod
+    def write_review(cls):
+        """ add deferred items of this run to review.json, return path """
+        log_folder = cls.CONFIG['media']['log_folder']
+        review_file = os.path.join(log_folder, 'review.json')
+        try:
+            with open(review_file, 'r', encoding='utf-8') as f:
+                review = json.load(f)
+        except FileNotFoundError:
+            review = []
+        # newest entry per file only
+        deferred_files = {i['filename'] for i in cls.deferred}
+        review = [i for i in review if i['filename'] not in deferred_files]
+        review.extend(cls.deferred)
+        write_atomic(review_file, json.dumps(review, indent=2))
+        return review_file
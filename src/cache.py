@@ -0,0 +1,101 @@
+""" persistent on disk cache for api responses """
+
+import json
+from time import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from src.sqlite_store import SqliteStore
+
+
+class ResponseCache(SqliteStore):
+    """ single file sqlite store keyed on the normalized request url """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS responses ('
+        'url TEXT PRIMARY KEY, body TEXT NOT NULL, size INTEGER NOT NULL, '
+        'expires REAL NOT NULL, last_access REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_last_access '
+        'ON responses (last_access)'
+    )
+    # query parameters never part of the key
+    IGNORE_PARAMS = ('api_key',)
+    # seconds, hits within this keep the stored last_access, no write
+    TOUCH_INTERVAL = 60 * 60
+
+    def __init__(self, db_name='api_cache.db'):
+        super().__init__(db_name)
+        max_mb = self.CONFIG['media'].get('cache_max_mb', 50)
+        self.max_size = max_mb * 1024 * 1024
+
+    @classmethod
+    def normalize_url(cls, url):
+        """ build cache key independent of scheme and parameter order """
+        split = urlsplit(url)
+        query = [
+            (key, value) for key, value in parse_qsl(split.query)
+            if key not in cls.IGNORE_PARAMS
+        ]
+        query_str = urlencode(sorted(query))
+        key = f'{split.netloc.lower()}{split.path.rstrip("/")}?{query_str}'
+        return key
+
+    def get(self, url):
+        """ return cached response or None if missing or expired """
+        key = self.normalize_url(url)
+        now = time()
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute(
+                'SELECT body, expires, last_access FROM responses '
+                'WHERE url = ?', (key,)
+            ).fetchone()
+            if not row:
+                return None
+            body, expires, last_access = row
+            if expires < now:
+                conn.execute('DELETE FROM responses WHERE url = ?', (key,))
+                conn.commit()
+                return None
+            if now - last_access > self.TOUCH_INTERVAL:
+                conn.execute(
+                    'UPDATE responses SET last_access = ? WHERE url = ?',
+                    (now, key)
+                )
+                conn.commit()
+        return json.loads(body)
+
+    def set(self, url, response, ttl):
+        """ store json serializable response for ttl seconds """
+        key = self.normalize_url(url)
+        body = json.dumps(response)
+        now = time()
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(url, body, size, expires, last_access) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, body, len(body), now + ttl, now)
+            )
+            conn.commit()
+            self.evict()
+
+    def evict(self):
+        """ drop expired, then least recently used until below max_size """
+        conn = self.conn
+        conn.execute('DELETE FROM responses WHERE expires < ?', (time(),))
+        total = conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+        if total > self.max_size:
+            rows = conn.execute(
+                'SELECT url, size FROM responses ORDER BY last_access'
+            )
+            to_delete = []
+            for url, size in rows:
+                if total <= self.max_size:
+                    break
+                to_delete.append((url,))
+                total = total - size
+            conn.executemany('DELETE FROM responses WHERE url = ?', to_delete)
+        conn.commit()
@@ -1,18 +1,24 @@
 """ export collection from emby to CSV """
 
-import csv
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from time import sleep
 from os import path
 
-import requests
-
+from src.api_client import EMBY
+from src.atomic_file import write_atomic
 from src.config import get_config
+from src.export_sinks import SINKS
 
 
 class EmbyLibrary:
     """ handle emby library refresh status """
 
     CONFIG = get_config()
+    # seconds, allow for clock differences with the emby server
+    CLOCK_MARGIN = 60
 
     def __init__(self):
         self.ready = self.wait_for_it()
@@ -39,260 +45,350 @@ class EmbyLibrary:
         emby_url = self.CONFIG['emby']['emby_url']
         emby_api_key = self.CONFIG['emby']['emby_api_key']
         url = f'{emby_url}/Library/VirtualFolders?api_key={emby_api_key}'
-
-        try:
-            response = requests.get(url).json()
-        except requests.exceptions.ConnectionError:
-            sleep(5)
-            response = requests.get(url).json()
+        response = EMBY.get_json(url)
 
         all_libraries = [i['RefreshStatus'] for i in response]
         all_active = [i for i in all_libraries if i != 'Idle']
 
         return all_active
 
+    @classmethod
+    def get_count(cls, item_type, min_date_saved=None):
+        """ number of items, only saved since min_date_saved if set """
+        emby_url = cls.CONFIG['emby']['emby_url']
+        emby_user_id = cls.CONFIG['emby']['emby_user_id']
+        emby_api_key = cls.CONFIG['emby']['emby_api_key']
+        url = (f'{emby_url}/Users/{emby_user_id}/Items?api_key={emby_api_key}'
+               f'&Recursive=true&IncludeItemTypes={item_type}&Limit=0')
+        if min_date_saved:
+            url = url + f'&MinDateLastSaved={min_date_saved}'
+        response = EMBY.get_json(url)
+        return response['TotalRecordCount']
+
+    @classmethod
+    def get_state(cls, item_type, last=None):
+        """
+        cheap check with Limit=0 requests, changed is False if nothing
+        got added, removed or saved since the last state
+        """
+        checked = cls.get_checked()
+        count = cls.get_count(item_type)
+        changed = True
+        if last and last['count'] == count:
+            changed = bool(cls.get_count(item_type, last['checked']))
+        state = {
+            'count': count,
+            'checked': checked,
+            'changed': changed
+        }
+        return state
+
+    @classmethod
+    def get_checked(cls):
+        """ utc timestamp for MinDateLastSaved of the next check """
+        checked = datetime.now(timezone.utc) - timedelta(
+            seconds=cls.CLOCK_MARGIN
+        )
+        return checked.strftime('%Y-%m-%dT%H:%M:%SZ')
+
 
 class DatabaseExport:
-    """ saves database to CSV """
+    """ saves database to sinks, only items changed since the last export """
 
     CONFIG = get_config()
+    # items per request and requests in flight
+    PAGE_SIZE = 500
+    WORKERS = 2
+    # kind: (filter, fields)
+    QUERIES = {
+        'movies': (
+            '&Recursive=true&IncludeItemTypes=Movie',
+            '&fields=DateCreated,Genres,MediaStreams,Overview,'
+            'ProviderIds,Path,RunTimeTicks'
+        ),
+        'episodes': (
+            '&IncludeItemTypes=Episode&Recursive=true&IsMissing=false',
+            '&Fields=DateCreated,Genres,MediaStreams,'
+            'MediaSources,Overview,ProviderIds,Path,RunTimeTicks'
+        )
+    }
+    SORT = '&SortBy=DateCreated&SortOrder=Descending'
+    # older snapshots miss rows, export everything again
+    SNAPSHOT_VERSION = 2
 
     def __init__(self):
-        self.all_movies, self.all_episodes = self.get_items()
-
-    def get_items(self):
-        """ get json from emby """
+        log_folder = self.CONFIG['media']['log_folder']
+        self.snapshot_path = path.join(log_folder, 'export_snapshot.json')
+        self.snapshot = self.get_snapshot()
+        formats = self.CONFIG['emby'].get('export_formats', ['csv'])
+        self.sinks = [SINKS[i]() for i in formats]
+        # changed items by kind
+        self.counts = {}
+
+    def get_snapshot(self):
+        """ rows of last export by kind and item id, empty if missing """
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            snapshot = {}
+        if snapshot.get('version') != self.SNAPSHOT_VERSION:
+            snapshot = {'version': self.SNAPSHOT_VERSION}
+        return snapshot
+
+    def save_snapshot(self):
+        """ write snapshot atomically """
+        write_atomic(self.snapshot_path, json.dumps(self.snapshot))
+
+    def get_url(self, query):
+        """ items url of the user with query appended """
         emby_url = self.CONFIG['emby']['emby_url']
         emby_user_id = self.CONFIG['emby']['emby_user_id']
         emby_api_key = self.CONFIG['emby']['emby_api_key']
-        # movies
         url = (f'{emby_url}/Users/{emby_user_id}/Items?api_key={emby_api_key}'
-               '&Recursive=true&IncludeItemTypes=Movie'
-               '&fields=Genres,MediaStreams,Overview,'
-               'ProviderIds,Path,RunTimeTicks'
-               '&SortBy=DateCreated&SortOrder=Descending')
-        try:
-            response = requests.get(url)
-        except requests.exceptions.ConnectionError:
-            sleep(5)
-            response = requests.get(url)
-
-        all_movies = response.json()['Items']
-        # episodes
-        url = (f'{emby_url}/Users/{emby_user_id}/Items?api_key={emby_api_key}'
-               '&IncludeItemTypes=Episode&Recursive=true&StartIndex=0'
-               '&Fields=DateCreated,Genres,MediaStreams,'
-               'MediaSources,Overview,ProviderIds,Path,RunTimeTicks'
-               '&SortBy=DateCreated&SortOrder=Descending&IsMissing=false')
-        try:
-            response = requests.get(url)
-        except requests.exceptions.ConnectionError:
-            sleep(5)
-            response = requests.get(url)
-
-        all_episodes = response.json()['Items']
-        return all_movies, all_episodes
+               + query)
+        return url
+
+    def get_items(self, query):
+        """
+        yield items page by page in query order, keeps
+        WORKERS pages fetching ahead
+        """
+        url = self.get_url(query + f'&Limit={self.PAGE_SIZE}')
+        first_page = EMBY.get_json(url + '&StartIndex=0')
+        yield first_page['Items']
+        total = first_page['TotalRecordCount']
+        to_fetch = deque(range(self.PAGE_SIZE, total, self.PAGE_SIZE))
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            in_flight = deque()
+            while to_fetch or in_flight:
+                while to_fetch and len(in_flight) < self.WORKERS:
+                    page_url = url + f'&StartIndex={to_fetch.popleft()}'
+                    in_flight.append(executor.submit(EMBY.get_json, page_url))
+                yield in_flight.popleft().result()['Items']
 
     def parse_movies(self):
         """ handle the movies """
-        all_movies = self.all_movies
-        # seen
-        movie_seen = ListParser.build_seen(all_movies)
-        self.write_seen(movie_seen, 'movienew')
-        # tech
-        movie_tech = ListParser.build_tech(all_movies)
-        self.write_csv(movie_tech, 'movie-tech.csv')
-        # info
-        movie_info = ListParser.build_movie_info(all_movies)
-        self.write_csv(movie_info, 'movie-info.csv')
+        self.counts['movies'] = self.export_items(
+            'movies', ListParser.get_movie_info
+        )
 
     def parse_episodes(self):
         """ handle the episodes """
-        all_episodes = self.all_episodes
-        # seen
-        episode_seen = ListParser.build_seen(all_episodes)
-        self.write_seen(episode_seen, 'episodenew')
-        # tech
-        episode_tech = ListParser.build_tech(all_episodes)
-        self.write_csv(episode_tech, 'episode-tech.csv')
-        # info
-        episode_info = ListParser.build_episode_info(all_episodes)
-        self.write_csv(episode_info, 'episode-info.csv')
-
-    def write_csv(self, to_write, filename):
-        """ write list of dicts to CSV """
+        self.counts['episodes'] = self.export_items(
+            'episodes', ListParser.get_episode_info
+        )
 
-        log_folder = self.CONFIG['media']['log_folder']
-        file_path = path.join(log_folder, filename)
-
-        # open and write
-        with open(file_path, 'w', encoding='utf-8') as f:
-            # take fieldnames from first line
-            fieldnames = to_write[0].keys()
-            csv_writer = csv.DictWriter(f, fieldnames)
-            csv_writer.writeheader()
-            csv_writer.writerows(to_write)
-
-    def write_seen(self, to_write, filename):
-        """ write list of seen """
-        log_folder = self.CONFIG['media']['log_folder']
-        file_path = path.join(log_folder, filename)
-        # movie by new
-        with open(file_path, 'w', encoding='utf-8') as f:
-            for line in to_write:
-                f.write(line + '\n')
+    def export_items(self, kind, get_info):
+        """
+        fetch items of kind changed since last export, merge into
+        snapshot and write to all sinks, return changed item count
+        """
+        item_filter, fields = self.QUERIES[kind]
+        last = self.snapshot.get(kind)
+        checked = EmbyLibrary.get_checked()
+        if last:
+            items = last['items']
+            # user data like played has its own date
+            queries = [
+                f'{item_filter}{fields}&MinDateLastSaved={last["checked"]}',
+                (f'{item_filter}{fields}'
+                 f'&MinDateLastSavedForUser={last["checked"]}')
+            ]
+        else:
+            items = {}
+            queries = [item_filter + fields + self.SORT]
+        # in both queries if saved and played since last
+        changed = set()
+        for query in queries:
+            for page in self.get_items(query):
+                for item in page:
+                    items[item['Id']] = ListParser.get_record(item, get_info)
+                    changed.add(item['Id'])
+        removed = self.remove_deleted(item_filter, items)
+        if changed or removed or not last:
+            # unchanged keeps the old checked, next run asks a bit more
+            self.snapshot[kind] = {'checked': checked, 'items': items}
+            self.save_snapshot()
+        self.write_sinks(kind, items, bool(changed or removed))
+        return len(changed)
+
+    def write_sinks(self, kind, items, changed):
+        """ write items to sinks if changed, missing sinks always """
+        to_write = [i for i in self.sinks if changed or i.is_missing(kind)]
+        if not to_write:
+            return
+        # newest first as in emby
+        by_created = sorted(
+            items.items(), key=lambda i: i[1]['created'], reverse=True
+        )
+        for sink in to_write:
+            sink.write(kind, by_created)
+
+    def remove_deleted(self, item_filter, items):
+        """ drop items gone from emby, only list ids if count differs """
+        total = EMBY.get_json(
+            self.get_url(item_filter + '&Limit=0')
+        )['TotalRecordCount']
+        if total == len(items):
+            return 0
+        all_ids = set()
+        id_query = item_filter + '&EnableImages=false&EnableUserData=false'
+        for page in self.get_items(id_query):
+            all_ids.update(i['Id'] for i in page)
+        removed = [i for i in items if i not in all_ids]
+        for item_id in removed:
+            items.pop(item_id)
+        return len(removed)
 
 
 class ListParser:
-    """ static parse the lists from DatabaseExport """
+    """ static parse single items from DatabaseExport """
 
     @staticmethod
-    def build_seen(filelist):
-        """ build the seen list """
-
-        file_item_seen = []
-
-        for file_item in filelist:
-            played = file_item['UserData']['Played']
-            file_name = path.basename(file_item['Path'])
-            file_item_name = path.splitext(file_name)[0]
-            for stream in file_item['MediaStreams']:
-                if stream['Type'] == 'Video':
-                    width = stream['Width']
-                    height = stream['Height']
-                    break
-            # seen or unseen
-            if played:
-                icon = '[X]'
-            else:
-                icon = '[ ]'
-            seen_line = f'{icon} {file_item_name} [{width}x{height}]'
-            file_item_seen.append(seen_line)
-
-        return file_item_seen
+    def get_video(streams):
+        """ first video stream or empty dict """
+        for stream in streams:
+            if stream['Type'] == 'Video':
+                return stream
+        return {}
 
     @staticmethod
-    def build_tech(filelist):
-        """ build tech csv """
-
-        file_item_tech = []
-
-        for file_item in filelist:
-            # loop through media sources
-            for i in file_item['MediaSources']:
-                if i['Protocol'] == 'File':
-                    filesize = round(i['Size'] / 1024 / 1024)
-                    for j in i['MediaStreams']:
-                        if j['Type'] == 'Video':
-                            image_width = j['Width']
-                            image_height = j['Height']
-                            avg_bitrate = round(j['BitRate'] / 1024 / 1024, 2)
-                            codec = j['Codec']
-                            # found it
-                            break
-                    # found it
-                    break
-            # technical csv
-            tech_dict = {
-                'file_name': path.basename(file_item['Path']),
-                'duration_min': round(file_item['RunTimeTicks'] / 600000000),
-                'filesize_MB': filesize,
-                'image_width': image_width,
-                'image_height': image_height,
-                'avg_bitrate_MB': avg_bitrate,
-                'codec': codec
-            }
-            file_item_tech.append(tech_dict)
+    def get_record(item, get_info):
+        """ snapshot record of item, info parsed with get_info """
+        seen_line, tech_dict = ListParser.get_seen_tech(item)
+        record = {
+            'created': item.get('DateCreated', ''),
+            'played': item['UserData']['Played'],
+            'seen': seen_line,
+            'tech': tech_dict,
+            'info': get_info(item),
+            'streams': ListParser.get_streams(item)
+        }
+        return record
 
-        # sort and return
-        file_item_tech_sorted = sorted(
-            file_item_tech, key=lambda k: k['file_name']
-        )
-        return file_item_tech_sorted
+    @staticmethod
+    def get_seen_tech(file_item):
+        """ build seen line and tech dict in one go """
+        # seen
+        video = ListParser.get_video(file_item['MediaStreams'])
+        file_name = path.basename(file_item['Path'])
+        file_item_name = path.splitext(file_name)[0]
+        width = video.get('Width')
+        height = video.get('Height')
+        # seen or unseen
+        if file_item['UserData']['Played']:
+            icon = '[X]'
+        else:
+            icon = '[ ]'
+        seen_line = f'{icon} {file_item_name} [{width}x{height}]'
+        # tech from first file media source
+        filesize = avg_bitrate = None
+        tech_video = {}
+        for source in file_item['MediaSources']:
+            if source['Protocol'] == 'File':
+                filesize = round(source['Size'] / 1024 / 1024)
+                tech_video = ListParser.get_video(source['MediaStreams'])
+                break
+        if 'BitRate' in tech_video:
+            avg_bitrate = round(tech_video['BitRate'] / 1024 / 1024, 2)
+        # technical csv
+        tech_dict = {
+            'file_name': file_name,
+            'duration_min': round(file_item['RunTimeTicks'] / 600000000),
+            'filesize_MB': filesize,
+            'image_width': tech_video.get('Width'),
+            'image_height': tech_video.get('Height'),
+            'avg_bitrate_MB': avg_bitrate,
+            'codec': tech_video.get('Codec')
+        }
+        return seen_line, tech_dict
 
     @staticmethod
-    def build_movie_info(all_movies):
-        """ build movie info csv """
-
-        movie_info = []
-
-        for movie in all_movies:
-
-            try:
-                imdb = movie['ProviderIds']['Imdb']
-            except KeyError:
-                imdb = False
-
-            try:
-                overview = movie['Overview']
-            except KeyError:
-                overview = False
-
-            info_dict = {
-                'movie_name': movie['Name'],
-                'year': movie['Path'].split('/')[3],
-                'imdb': imdb,
-                'genres': ', '.join(movie['Genres']),
-                'overview': overview,
-                'duration_min': round(movie['RunTimeTicks'] / 600000000)
+    def get_streams(file_item):
+        """ build media stream rows """
+        streams = []
+        for stream in file_item['MediaStreams']:
+            stream_dict = {
+                'stream_index': stream.get('Index'),
+                'type': stream.get('Type'),
+                'codec': stream.get('Codec'),
+                'language': stream.get('Language'),
+                'width': stream.get('Width'),
+                'height': stream.get('Height'),
+                'bitrate': stream.get('BitRate'),
+                'channels': stream.get('Channels')
             }
-            movie_info.append(info_dict)
-
-        # sort and return
-        movie_info_sorted = sorted(movie_info, key=lambda k: k['movie_name'])
-        return movie_info_sorted
+            streams.append(stream_dict)
+        return streams
 
     @staticmethod
-    def build_episode_info(all_episodes):
-        """ build episode info csv """
-
-        episode_info = []
-
-        for episode in all_episodes:
-            try:
-                episode_id = episode['IndexNumber']
-            except KeyError:
-                # not a real episode
-                continue
-            try:
-                overview = episode['Overview'].replace('\n\n', ' ')
-                overview = overview.replace('\n', ' ')
-            except KeyError:
-                overview = 'NA'
-            try:
-                imdb = episode['ProviderIds']['Imdb']
-            except KeyError:
-                imdb = 'NA'
-
-            # info csv
-            info_dict = {
-                'episode_id': episode_id,
-                'overview': overview,
-                'imdb': imdb,
-                'episode_name': episode['Name'],
-                'file_name': path.basename(episode['Path']),
-                'genres': ', '.join(episode['Genres']),
-                'series_name': episode['SeriesName'],
-                'season_name': episode['SeasonName'],
-                'duration_min': round(episode['RunTimeTicks'] / 600000000)
-            }
-            episode_info.append(info_dict)
+    def get_movie_info(movie):
+        """ build movie info csv row """
 
-        # sort and return
-        episode_info_sorted = sorted(
-            episode_info, key=lambda k: k['file_name']
-        )
-        return episode_info_sorted
+        try:
+            imdb = movie['ProviderIds']['Imdb']
+        except KeyError:
+            imdb = False
+
+        try:
+            overview = movie['Overview']
+        except KeyError:
+            overview = False
+
+        info_dict = {
+            'movie_name': movie['Name'],
+            'year': movie['Path'].split('/')[3],
+            'imdb': imdb,
+            'genres': ', '.join(movie['Genres']),
+            'overview': overview,
+            'duration_min': round(movie['RunTimeTicks'] / 600000000)
+        }
+        return info_dict
+
+    @staticmethod
+    def get_episode_info(episode):
+        """ build episode info csv row, None if not a real episode """
+        try:
+            episode_id = episode['IndexNumber']
+        except KeyError:
+            # not a real episode
+            return None
+        try:
+            overview = episode['Overview'].replace('\n\n', ' ')
+            overview = overview.replace('\n', ' ')
+        except KeyError:
+            overview = 'NA'
+        try:
+            imdb = episode['ProviderIds']['Imdb']
+        except KeyError:
+            imdb = 'NA'
+
+        # info csv
+        info_dict = {
+            'episode_id': episode_id,
+            'overview': overview,
+            'imdb': imdb,
+            'episode_name': episode['Name'],
+            'file_name': path.basename(episode['Path']),
+            'genres': ', '.join(episode['Genres']),
+            'series_name': episode['SeriesName'],
+            'season_name': episode['SeasonName'],
+            'duration_min': round(episode['RunTimeTicks'] / 600000000)
+        }
+        return info_dict
 
 
 def main():
-    """ main to regenerate csv files """
-    print('recreating csv files')
+    """ main to update exported files """
+    print('updating exported files')
     # stop if scan in progress
     lib_state = EmbyLibrary()
     if not lib_state.ready:
-        return
+        return 0
 
     export = DatabaseExport()
     export.parse_movies()
     export.parse_episodes()
+    print(f'exported {sum(export.counts.values())} changed items')
+    return sum(export.counts.values())
@@ -0,0 +1,243 @@
+""" write the exported library rows to csv, sqlite or jsonl """
+
+import csv
+import io
+import json
+import os
+import sqlite3
+from operator import itemgetter
+
+from src.atomic_file import write_atomic
+from src.config import get_config
+
+
+def write_if_changed(file_path, content):
+    """ replace file atomically, only if content is different """
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    write_atomic(file_path, content)
+    return True
+
+
+class SortedCsv:
+    """ collect formatted csv lines, sorted by key at the end """
+
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.csv_writer = None
+        self.header = ''
+        # (sort key, formatted line)
+        self.lines = []
+
+    def add(self, key, row):
+        """ format row dict, fieldnames taken from the first row """
+        if not self.csv_writer:
+            self.csv_writer = csv.DictWriter(self.buffer, row.keys())
+            self.csv_writer.writeheader()
+            self.header = self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        self.csv_writer.writerow(row)
+        self.lines.append((key, self.buffer.getvalue()))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def get_content(self):
+        """ header and lines sorted stable by key """
+        self.lines.sort(key=itemgetter(0))
+        return self.header + ''.join(i[1] for i in self.lines)
+
+
+class CsvSink:
+    """ seen list, tech and info csv files """
+
+    CONFIG = get_config()
+    # kind: ((seen, tech, info), info sort key)
+    FILES = {
+        'movies': (
+            ('movienew', 'movie-tech.csv', 'movie-info.csv'), 'movie_name'
+        ),
+        'episodes': (
+            ('episodenew', 'episode-tech.csv', 'episode-info.csv'),
+            'file_name'
+        )
+    }
+
+    def __init__(self):
+        self.log_folder = self.CONFIG['media']['log_folder']
+
+    def is_missing(self, kind):
+        """ true if any file of kind doesn't exist """
+        filenames, _ = self.FILES[kind]
+        return not all(
+            os.path.exists(os.path.join(self.log_folder, i))
+            for i in filenames
+        )
+
+    def write(self, kind, items):
+        """ items: list of (item_id, row), newest first as in emby """
+        (seen_name, tech_name, info_name), info_key = self.FILES[kind]
+        seen = ''.join(i['seen'] + '\n' for _, i in items)
+        write_if_changed(os.path.join(self.log_folder, seen_name), seen)
+        tech_csv = SortedCsv()
+        info_csv = SortedCsv()
+        for _, item in items:
+            tech_csv.add(item['tech']['file_name'], item['tech'])
+            if item['info']:
+                info_csv.add(item['info'][info_key], item['info'])
+        write_if_changed(
+            os.path.join(self.log_folder, tech_name), tech_csv.get_content()
+        )
+        write_if_changed(
+            os.path.join(self.log_folder, info_name), info_csv.get_content()
+        )
+
+
+class JsonlSink:
+    """ one json object per line and item """
+
+    CONFIG = get_config()
+
+    def __init__(self):
+        self.log_folder = self.CONFIG['media']['log_folder']
+
+    def is_missing(self, kind):
+        """ true if file of kind doesn't exist """
+        return not os.path.exists(
+            os.path.join(self.log_folder, f'{kind}.jsonl')
+        )
+
+    def write(self, kind, items):
+        """ items: list of (item_id, row), newest first as in emby """
+        content = ''.join(
+            json.dumps({'id': item_id, **item}) + '\n'
+            for item_id, item in items
+        )
+        file_path = os.path.join(self.log_folder, f'{kind}.jsonl')
+        write_if_changed(file_path, content)
+
+
+class SqliteSink:
+    """ indexed tables for movies, episodes and their media streams """
+
+    CONFIG = get_config()
+    TECH_COLUMNS = (
+        'file_name', 'duration_min', 'filesize_MB', 'image_width',
+        'image_height', 'avg_bitrate_MB', 'codec'
+    )
+    # kind: (info columns, indexed columns)
+    TABLES = {
+        'movies': (
+            ('movie_name', 'year', 'imdb', 'genres', 'overview'),
+            ('movie_name', 'year', 'codec')
+        ),
+        'episodes': (
+            ('series_name', 'season_name', 'episode_id', 'episode_name',
+             'imdb', 'genres', 'overview'),
+            ('series_name', 'codec')
+        )
+    }
+    STREAM_COLUMNS = (
+        'stream_index', 'type', 'codec', 'language', 'width', 'height',
+        'bitrate', 'channels'
+    )
+
+    def __init__(self):
+        log_folder = self.CONFIG['media']['log_folder']
+        self.db_path = os.path.join(log_folder, 'library.db')
+
+    def get_columns(self, kind):
+        """ all columns of the kind table in order """
+        info_columns, _ = self.TABLES[kind]
+        return ('id', 'created', 'played') + self.TECH_COLUMNS + info_columns
+
+    def connect(self):
+        """ open database and create missing tables """
+        conn = sqlite3.connect(self.db_path)
+        for kind, (_, indexed) in self.TABLES.items():
+            columns = ', '.join(self.get_columns(kind)[1:])
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {kind} '
+                f'(id TEXT PRIMARY KEY, {columns})'
+            )
+            for column in indexed:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{kind}_{column} '
+                    f'ON {kind} ({column})'
+                )
+        stream_columns = ', '.join(self.STREAM_COLUMNS)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS media_streams '
+            f'(item_id TEXT NOT NULL, kind TEXT NOT NULL, {stream_columns})'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_media_streams_item '
+            'ON media_streams (item_id)'
+        )
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_media_streams_codec '
+            'ON media_streams (type, codec)'
+        )
+        return conn
+
+    def is_missing(self, kind):
+        """ true if database or the table of kind is empty """
+        if not os.path.exists(self.db_path):
+            return True
+        conn = self.connect()
+        try:
+            return not conn.execute(f'SELECT 1 FROM {kind} LIMIT 1').fetchone()
+        finally:
+            conn.close()
+
+    def write(self, kind, items):
+        """ replace all rows of kind in one transaction """
+        columns = self.get_columns(kind)
+        rows = []
+        streams = []
+        for item_id, item in items:
+            row = {
+                'id': item_id,
+                'created': item['created'],
+                'played': item['played'],
+                **item['tech'],
+                **(item['info'] or {})
+            }
+            rows.append(tuple(row.get(i) for i in columns))
+            streams.extend(
+                (item_id, kind) + tuple(i[j] for j in self.STREAM_COLUMNS)
+                for i in item['streams']
+            )
+        placeholders = ', '.join('?' for _ in columns)
+        stream_placeholders = ', '.join(
+            '?' for _ in range(len(self.STREAM_COLUMNS) + 2)
+        )
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(f'DELETE FROM {kind}')
+                conn.execute(
+                    'DELETE FROM media_streams WHERE kind = ?', (kind,)
+                )
+                conn.executemany(
+                    f'INSERT INTO {kind} ({", ".join(columns)}) '
+                    f'VALUES ({placeholders})', rows
+                )
+                conn.executemany(
+                    'INSERT INTO media_streams (item_id, kind, '
+                    f'{", ".join(self.STREAM_COLUMNS)}) '
+                    f'VALUES ({stream_placeholders})', streams
+                )
+        finally:
+            conn.close()
+
+
+SINKS = {
+    'csv': CsvSink,
+    'sqlite': SqliteSink,
+    'jsonl': JsonlSink
+}
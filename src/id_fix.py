@@ -2,13 +2,14 @@
 
 import os
 import re
-import subprocess
 from time import sleep
 
-import requests
-
+from src.api_client import EMBY
+from src.batch import Batch
 from src.config import get_config
 from src.db_export import EmbyLibrary
+from src.transfer import Transfer
+from src.trash import Trash
 
 
 class MovieNameFix:
@@ -16,10 +17,27 @@ class MovieNameFix:
     rename if premiere date doesn't match with filename """
 
     CONFIG = get_config()
+    TRANSFER = Transfer()
+    TRASH = Trash()
+    YEAR_PATTERN = re.compile(r'\((\d{4})\)$')
+    # not allowed in filenames
+    SLASH_TO_DASH = str.maketrans('/', '-')
+    # library state and pending of the last check in this process
+    LAST = {}
 
     def __init__(self):
+        self.movie_list = []
+        self.pending = self.get_pending()
+
+    def get_pending(self):
+        """ reuse last result if the movie library didn't change """
+        state = EmbyLibrary.get_state('Movie', self.LAST.get('state'))
+        if not state['changed']:
+            return self.LAST['pending']
         self.movie_list = self.get_emby_list()
-        self.pending = self.find_errors()
+        pending = self.find_errors(self.movie_list)
+        self.LAST.update({'state': state, 'pending': pending})
+        return pending
 
     def get_emby_list(self):
         """ get current emby movie list """
@@ -30,21 +48,23 @@ class MovieNameFix:
         url = (f'{emby_url}/Users/{emby_user_id}/Items?api_key={emby_api_key}'
                '&Recursive=True&IncludeItemTypes=Movie'
                '&Fields=Path,PremiereDate')
-        request = requests.get(url).json()
+        request = EMBY.get_json(url)
         movie_list = request['Items']
         return movie_list
 
-    def find_errors(self):
+    @classmethod
+    def find_errors(cls, movie_list):
         """ find missmatch in movie_list """
 
         errors = []
-        for movie in self.movie_list:
+        for movie in movie_list:
             # parse filename
             file_name = os.path.basename(movie['Path'])
-            ext = os.path.splitext(file_name)[1]
-            movie_name = os.path.splitext(file_name)[0]
-            year_id_pattern = re.compile(r'\((\d{4})\)$')
-            file_year = year_id_pattern.findall(movie_name)[-1]
+            movie_name, ext = os.path.splitext(file_name)
+            year_match = cls.YEAR_PATTERN.search(movie_name)
+            if not year_match:
+                continue
+            file_year = year_match.group(1)
             movie_name_file = movie_name.split(f'({file_year})')[0].strip()
             # premier date
             try:
@@ -53,11 +73,7 @@ class MovieNameFix:
                 premier_year = file_year
             # emby
             emby_name = movie['Name']
-            error = False
-            if emby_name != movie_name_file:
-                diff = self.str_diff(emby_name, movie_name_file)
-                if diff:
-                    error = True
+            error = not cls.is_same_name(emby_name, movie_name_file)
             if premier_year != file_year:
                 error = True
                 emby_name = movie_name_file
@@ -71,24 +87,12 @@ class MovieNameFix:
                 errors.append(error_dict)
         return errors
 
-    @staticmethod
-    def str_diff(str1, str2):
-        """ simple diff calculator between two strings
-        ignoreing - and / """
-        diff = []
-        for num, value in enumerate(str1):
-            try:
-                if value not in (str2[num], '/'):
-                    diff.append(value)
-            except IndexError:
-                diff.append(value)
-        for num, value in enumerate(str2):
-            try:
-                if value not in (str1[num], '-'):
-                    diff.append(value)
-            except IndexError:
-                diff.append(value)
-        return list(diff)
+    @classmethod
+    def is_same_name(cls, emby_name, file_name):
+        """ compare names, / in emby is - in the filename """
+        if emby_name == file_name:
+            return True
+        return emby_name.translate(cls.SLASH_TO_DASH) == file_name
 
     def fix_errors(self):
         """ select what to do """
@@ -98,12 +102,17 @@ class MovieNameFix:
         for error in self.pending:
             old_name = error['old_name']
             new_name = error['new_name']
-            # prompt
             print(f'\nrenaming from-to:\n{old_name}\n{new_name}')
-            print('[0]: skip')
-            print('[1]: rename')
-            print('[c]: cancel')
-            select = input()
+            # emby is not reliable enough to rename unattended
+            if Batch.on_ambiguous in ('defer', 'best'):
+                Batch.defer('movie_fix', old_name, 'rename', [new_name])
+                select = '0'
+            else:
+                # prompt
+                print('[0]: skip')
+                print('[1]: rename')
+                print('[c]: cancel')
+                select = input()
 
             if select == '1':
                 self.rename_files(error)
@@ -113,10 +122,10 @@ class MovieNameFix:
                 continue
             elif select == 'c':
                 print('cancel')
-                return
+                return len(fixed)
             else:
                 print(f'{select} is invalid input')
-                return
+                return len(fixed)
         # pritty output
         if skipped:
             print('skipped files:')
@@ -124,31 +133,41 @@ class MovieNameFix:
                 print(i)
         if fixed:
             print(f'fixed {len(fixed)} movies')
+        return len(fixed)
 
-    def rename_files(self, error):
-        """ actually rename the files """
+    def get_folders(self, error):
+        """ old and new movie folder in the archive """
         moviepath = self.CONFIG['media']['moviepath']
         old_year = error['old_year']
         new_year = error['new_year']
         old_movie = os.path.splitext(error['old_name'])[0]
         old_folder = os.path.join(moviepath, old_year, old_movie)
         new_movie = os.path.splitext(error['new_name'])[0]
-        # handle folder
         if old_year != new_year:
             old_year_folder = os.path.split(old_folder)[0]
             new_year_folder = old_year_folder.replace(old_year, new_year)
             new_folder = os.path.join(new_year_folder, new_movie)
         else:
             new_folder = old_folder.replace(old_movie, new_movie)
+        return old_folder, new_folder
+
+    def rename_files(self, error):
+        """ actually rename the files """
+        old_movie = os.path.splitext(error['old_name'])[0]
+        new_movie = os.path.splitext(error['new_name'])[0]
+        # handle folder
+        old_folder, new_folder = self.get_folders(error)
         os.makedirs(new_folder)
         # handle files
+        to_move = []
         for file_name in os.listdir(old_folder):
             old_file = os.path.join(old_folder, file_name)
             new_file_name = file_name.replace(old_movie, new_movie)
             new_file = os.path.join(new_folder, new_file_name)
-            os.rename(old_file, new_file)
+            to_move.append((old_file, new_file))
+        self.TRANSFER.move_many(to_move)
         # trash now empty folder
-        subprocess.call(['trash', old_folder])
+        self.TRASH.trash_many([old_folder])
 
 
 def main():
@@ -156,12 +175,15 @@ def main():
     # stop if scan in progress
     lib_state = EmbyLibrary()
     if not lib_state.ready:
-        return
+        return 0
 
     handler = MovieNameFix()
 
     if not handler.pending:
         print('no errors found')
-        return
-    handler.fix_errors()
+        return 0
+    fixed = handler.fix_errors()
+    if fixed:
+        MovieNameFix.LAST.clear()
     sleep(2)
+    return fixed
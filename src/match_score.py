@@ -0,0 +1,89 @@
+""" confidence scoring to auto pick movie and show matches """
+
+import logging
+import math
+import re
+from difflib import SequenceMatcher
+
+from src.config import get_config
+
+
+class MatchScore:
+    """ score candidates between 0 and 1, pick best above threshold """
+
+    CONFIG = get_config()
+    NORMALIZE_PATTERN = re.compile(r'[^a-z0-9]+')
+    # best has to be this much ahead of second best
+    MIN_MARGIN = 0.1
+
+    def __init__(self):
+        self.threshold = self.CONFIG['media'].get('auto_pick_threshold')
+
+    @classmethod
+    def normalize(cls, name):
+        """ lower case alphanumeric words only """
+        name = name.lower().replace('%20', ' ').replace('%27', '')
+        name = name.replace("'", '').replace('&', 'and')
+        return cls.NORMALIZE_PATTERN.sub(' ', name).strip()
+
+    @classmethod
+    def similarity(cls, name_1, name_2):
+        """ ratio of matching characters of the normalized names """
+        name_1 = cls.normalize(name_1)
+        name_2 = cls.normalize(name_2)
+        if name_1 == name_2:
+            return 1.0
+        return SequenceMatcher(None, name_1, name_2).ratio()
+
+    @staticmethod
+    def popularity(count, full_at=1000):
+        """ log scaled 0 to 1, full_at or more counts as 1 """
+        if not count:
+            return 0
+        return min(math.log10(count + 1) / math.log10(full_at + 1), 1)
+
+    def score_movie(self, moviename, year, result):
+        """ score a tmdb search result against the parsed filename """
+        title = self.similarity(moviename, result['title'])
+        try:
+            year_distance = abs(int(result['release_date'][:4]) - year)
+        except (KeyError, ValueError):
+            year_distance = None
+        year_score = {0: 1, 1: 0.4}.get(year_distance, 0)
+        votes = self.popularity(result.get('vote_count'))
+        score = 0.6 * title + 0.25 * year_score + 0.15 * votes
+        return round(score, 3)
+
+    def score_show(self, showname, result):
+        """ score a tvmaze search result against the parsed showname """
+        title = self.similarity(showname, result['showname_clean'])
+        weight = (result.get('weight') or 0) / 100
+        status = 1 if result.get('status') == 'Running' else 0
+        score = 0.8 * title + 0.15 * weight + 0.05 * status
+        return round(score, 3)
+
+    def auto_pick(self, scores):
+        """
+        return index of clear winner above threshold
+        or None if picking needs manual review
+        """
+        if self.threshold is None or not scores:
+            return None
+        ranked = sorted(range(len(scores)), key=lambda i: -scores[i])
+        best = ranked[0]
+        if scores[best] < self.threshold:
+            return None
+        if len(ranked) > 1:
+            second = ranked[1]
+            if scores[best] - scores[second] < self.MIN_MARGIN:
+                return None
+        return best
+
+    @staticmethod
+    def log_decision(kind, filename, how, name, scores):
+        """ write pick and how it was made with all scores to rename.log """
+        all_scores = ', '.join(str(i) for i in scores)
+        logging.info(
+            '%s:%s pick [%s] for [%s] scores [%s]',
+            kind, how, name, filename, all_scores
+        )
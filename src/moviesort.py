@@ -3,51 +3,65 @@
 import logging
 import os
 import re
-import subprocess
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
+from src.api_client import TMDB
+from src.batch import Batch, Deferred
+from src.cache import ResponseCache
 from src.config import get_config
+from src.match_score import MatchScore
+from src.sort_handler import SortHandler
 
 
-class MovieHandler:
+class MovieHandler(SortHandler):
     """ handler for moving files around """
 
-    CONFIG = get_config()
+    KIND = 'movie'
+    DOWNPATH = 'movie_downpath'
 
     def __init__(self):
         """ check for pending movie files """
-        self.pending = self.get_pending()
+        super().__init__()
+        # filenames in sortpath handled by this run, as currently named
+        self.sorting = []
 
-    def get_pending(self):
+    def identify(self, to_rename):
         """
-        return how many movies are pending
-        return 0 when nothing to do
+        search all first, then pick, return list of MovieIdentify
+        with movie_details set
         """
-        movie_downpath = self.CONFIG['media']['movie_downpath']
-        pending = len(os.listdir(movie_downpath))
-        return pending
-
-    def move_to_sort(self):
-        """ moving files from movie_downpath to sortpath """
-        # read out config
-        sortpath = self.CONFIG['media']['sortpath']
-        movie_downpath = self.CONFIG['media']['movie_downpath']
-        min_file_size = self.CONFIG['media']['min_file_size']
-        ext = self.CONFIG['media']['ext']
-        for dirpath, _, filenames in os.walk(movie_downpath):
-            for filename in filenames:
-                path = os.path.join(dirpath, filename)
-                _, extension = os.path.splitext(path)
-                extension = extension.lstrip('.').lower()
-                f_size = os.stat(path).st_size
-                if (extension in ext and
-                        'sample' not in filename and
-                        f_size > min_file_size):
-                    move_to = os.path.join(sortpath, filename)
-                    os.rename(path, move_to)
-        pending = os.listdir(sortpath)
-        return pending
+        parsed = []
+        # resolved in an earlier run
+        identified = []
+        for filename in to_rename:
+            movie_details = self.resume(filename)
+            try:
+                movie = MovieIdentify(filename, movie_details)
+            except Deferred:
+                self.defer(filename)
+                continue
+            if movie_details:
+                print(f'{filename} (resumed)')
+                identified.append(movie)
+            else:
+                parsed.append(movie)
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            all_results = executor.map(lambda i: i.get_results(), parsed)
+            for movie, results in zip(parsed, all_results):
+                movie.results = results
+        for movie in parsed:
+            try:
+                movie.movie_details = movie.get_new_filename()
+            except Deferred:
+                self.defer(movie.filename)
+                continue
+            self.STATE.set(
+                self.identities[movie.filename], self.KIND, movie.filename,
+                'resolved', media_id=movie.movie_details['tmdb_id'],
+                details=movie.movie_details
+            )
+            identified.append(movie)
+        return identified
 
     def rename_files(self, identified):
         """ apply the identified filenames and rename """
@@ -58,6 +72,11 @@ class MovieHandler:
             old_file = os.path.join(sortpath, movie.filename)
             new_file = os.path.join(sortpath, new_filename)
             os.rename(old_file, new_file)
+            self.sorting.remove(movie.filename)
+            self.sorting.append(new_filename)
+            self.STATE.update(
+                self.identities[movie.filename], 'renamed', new_file
+            )
             logging.info(
                 'movie:from [%s] to [%s]', movie.filename, new_filename
             )
@@ -73,13 +92,13 @@ class MovieHandler:
         for movie in identified:
             new_filename = movie.movie_details['new_filename']
             print(f'from: {movie.filename} \nto: {new_filename}\n')
-        to_continue = input('\ncontinue? Y/n')
+        to_continue = Batch.confirm('\ncontinue? Y/n')
         if to_continue == 'n':
             print('cancle...')
             return False
-        moved = []
+        to_move = []
+        identities = []
         for movie in identified:
-            new_filename = movie.movie_details['new_filename']
             year_dedected = movie.movie_details['year_dedected']
             new_moviename = movie.movie_details['new_moviename']
             new_filename = movie.movie_details['new_filename']
@@ -87,54 +106,90 @@ class MovieHandler:
             new_folder = os.path.join(
                 moviepath, str(year_dedected), new_moviename
             )
+            if not self.make_archive_folder(movie, new_folder):
+                continue
             new_file = os.path.join(new_folder, new_filename)
-            try:
-                os.makedirs(new_folder)
-            except FileExistsError:
-                print(f'{new_filename}\nalready exists in archive')
-                double = input('[O]: overwrite, [s]: skip\n') or 'O'
-                if double == 'O':
-                    subprocess.call(["trash", new_folder])
-                    os.makedirs(new_folder)
-                elif double == 's':
-                    continue
-            os.rename(old_file, new_file)
-            moved.append(new_filename)
+            to_move.append((old_file, new_file))
+            identities.append(self.identities[movie.filename])
+        moved = self.TRANSFER.move_many(to_move)
+        self.STATE.archived(list(zip(identities, moved)))
         return len(moved)
 
-    def cleanup(self, moved):
-        """ clean up movie_downpath and sortpath folder """
+    def make_archive_folder(self, movie, new_folder):
+        """
+        create movie folder in archive, if it already exists ask to
+        overwrite, return False if deferred or skipped
+        """
+        new_filename = movie.movie_details['new_filename']
+        try:
+            os.makedirs(new_folder)
+            return True
+        except FileExistsError:
+            print(f'{new_filename}\nalready exists in archive')
+        # nobody there to confirm overwriting
+        if Batch.on_ambiguous == 'defer' or Batch.yes:
+            sortpath = self.CONFIG['media']['sortpath']
+            Batch.defer('movie', new_filename, 'exists in archive')
+            self.deferred.append(new_filename)
+            self.STATE.update(
+                self.identities[movie.filename], 'deferred',
+                os.path.join(sortpath, new_filename)
+            )
+            return False
+        double = Batch.confirm('[O]: overwrite, [s]: skip\n') or 'O'
+        if double == 'O':
+            self.TRASH.trash_many([new_folder])
+            os.makedirs(new_folder)
+        elif double == 's':
+            return False
+        return True
+
+    def cleanup(self, moved, entries=None):
+        """ clean up sortpath and movie_downpath or only its entries """
         sortpath = self.CONFIG['media']['sortpath']
         movie_downpath = self.CONFIG['media']['movie_downpath']
         if moved:
             # moved without errors
-            to_clean_list = os.listdir(movie_downpath)
-            for to_clean in to_clean_list:
-                to_trash = os.path.join(movie_downpath, to_clean)
-                subprocess.call(["trash", to_trash])
-            to_clean_list = os.listdir(sortpath)
-            for to_clean in to_clean_list:
-                to_trash = os.path.join(sortpath, to_clean)
-                subprocess.call(["trash", to_trash])
+            to_clean_list = entries
+            if to_clean_list is None:
+                to_clean_list = os.listdir(movie_downpath)
+            to_trash = [
+                os.path.join(movie_downpath, i) for i in to_clean_list
+            ]
+            trashed = self.TRASH.trash_many(to_trash)
+            # keep deferred for next run
+            self.move_back(self.deferred)
+            # skipped
+            to_trash = [
+                os.path.join(sortpath, i) for i in self.sorting
+                if os.path.isfile(os.path.join(sortpath, i))
+            ]
+            trashed = trashed + self.TRASH.trash_many(to_trash)
+            print(f'moved {trashed // 1024 // 1024} MB to trash')
         else:
             # failed to rename
-            move_back = os.listdir(sortpath)
-            for movie_pending in move_back:
-                old_path = os.path.join(sortpath, movie_pending)
-                new_path = os.path.join(movie_downpath, movie_pending)
-                os.rename(old_path, new_path)
+            self.move_back(self.sorting)
 
 
 class MovieIdentify:
     """ describes and identifies a single movie """
 
     CONFIG = get_config()
+    CACHE = ResponseCache()
+    CACHE_TTL = 60 * 60 * 24 * 7
+    SCORER = MatchScore()
 
-    def __init__(self, filename):
-        """ parse filename """
+    def __init__(self, filename, movie_details=None):
+        """
+        parse filename, results and details get added by main,
+        movie_details resolved in an earlier run skip the parsing
+        """
         self.filename = filename
-        self.file_parsed = self.split_filename()
-        self.movie_details = self.get_new_filename()
+        self.file_parsed = None
+        if not movie_details:
+            self.file_parsed = self.split_filename()
+        self.results = None
+        self.movie_details = movie_details
 
     def split_filename(self):
         """ build raw values from filename """
@@ -151,6 +206,9 @@ class MovieIdentify:
                 year_list.remove(year)
         if len(year_list) != 1:
             print('year extraction failed for:\n' + self.filename)
+            if Batch.on_ambiguous != 'ask':
+                Batch.defer('movie', self.filename, 'year extraction failed')
+                raise Deferred(self.filename)
             year = input('whats the year?\n')
         else:
             year = year_list[0]
@@ -172,62 +230,95 @@ class MovieIdentify:
         encoded = encoded.replace('.', '%20').replace("'", '%20')
         return encoded
 
+    @classmethod
+    def tmdb_request(cls, url):
+        """ get cached or call the api, cache key ignores api_key """
+        cached = cls.CACHE.get(url)
+        if cached is not None:
+            return cached
+        response = TMDB.get(url)
+        request = response.json()
+        if response.ok:
+            cls.CACHE.set(url, request, cls.CACHE_TTL)
+        return request
+
     def get_results(self):
         """ get all possible matches """
         movie_db_api = self.CONFIG['media']['movie_db_api']
         year_file = self.file_parsed['year']
         moviename_encoded = self.file_parsed['moviename_encoded']
-        # try +/- one year
+        # try +/- one year at once, first found in this order wins
         year_list = [year_file, year_file + 1, year_file - 1]
-        for year in year_list:
-            url = (
-                'https://api.themoviedb.org/3/search/movie?'
-                + f'api_key={movie_db_api}&query={moviename_encoded}'
-                + f'&year={year}&language=en-US&include_adult=false'
-                )
-            request = requests.get(url).json()
-            results = request['results']
-            # stop if found
-            if results:
-                break
+        url_list = [
+            ('https://api.themoviedb.org/3/search/movie?'
+             + f'api_key={movie_db_api}&query={moviename_encoded}'
+             + f'&year={year}&language=en-US&include_adult=false')
+            for year in year_list
+        ]
+        with ThreadPoolExecutor(max_workers=len(url_list)) as executor:
+            all_requests = executor.map(self.tmdb_request, url_list)
+            results = []
+            for request in all_requests:
+                results = request['results']
+                # stop if found
+                if results:
+                    break
         return results
 
     def pick_result(self, results):
-        """ select best possible match from list of results """
+        """ select best possible match, auto if confident, else menu """
         if len(results) == 1:
-            selection = 0
-        elif len(results) > 1:
-            short_list = []
-            long_list = []
-            counter = 0
-            for item in results:
-                nr = str(counter)
-                movie_title = item['title']
-                movie_date = item['release_date']
-                movie_year = movie_date.split('-')[0]
-                movie_desc = item['overview']
-                short_list_str = f'[{nr}] {movie_title} - {movie_year}'
-                long_list_str = f'{short_list_str}\n{movie_desc}'
-                short_list.append(short_list_str)
-                long_list.append(long_list_str)
-                counter = counter + 1
-            short_list.append('[?] show more')
-            # print short menu
-            print('\nfilename: ' + self.filename)
-            for line in short_list:
+            return 0
+        moviename = self.file_parsed['moviename']
+        year = self.file_parsed['year']
+        scores = [self.SCORER.score_movie(moviename, year, i) for i in results]
+        selection = self.SCORER.auto_pick(scores)
+        how = 'auto'
+        if selection is None:
+            candidates = [i['title'] for i in results]
+            selection = Batch.ambiguous(
+                'movie', self.filename, candidates, scores
+            )
+            how = Batch.on_ambiguous
+        if selection is None:
+            selection = self.result_menu(results, scores)
+            how = 'manual'
+        picked = results[int(selection)]['title']
+        self.SCORER.log_decision('movie', self.filename, how, picked, scores)
+        return int(selection)
+
+    def result_menu(self, results, scores):
+        """ simple menu to pick matching movie manually """
+        short_list = []
+        long_list = []
+        for counter, item in enumerate(results):
+            movie_title = item['title']
+            movie_year = item['release_date'].split('-')[0]
+            movie_desc = item['overview']
+            short_list_str = (f'[{counter}] {movie_title} - {movie_year}'
+                              + f' ({scores[counter]})')
+            long_list_str = f'{short_list_str}\n{movie_desc}'
+            short_list.append(short_list_str)
+            long_list.append(long_list_str)
+        short_list.append('[?] show more')
+        # print short menu
+        print('\nfilename: ' + self.filename)
+        for line in short_list:
+            print(line)
+        selection = input('select input: ')
+        # print long menu
+        if selection == '?':
+            for line in long_list:
                 print(line)
             selection = input('select input: ')
-            # print long menu
-            if selection == '?':
-                for line in long_list:
-                    print(line)
-                selection = input('select input: ')
-        return int(selection)
+        return selection
 
     def get_new_filename(self):
         """ get the new filename """
         file_ext = self.file_parsed['file_ext']
-        results = self.get_results()
+        results = self.results
+        if results is None:
+            results = self.get_results()
         selection = self.pick_result(results)
         result = results[selection]
         # build new_filename
@@ -237,6 +328,7 @@ class MovieIdentify:
         new_moviename = f'{cleaned_name} ({year_dedected})'
         new_filename = f'{new_moviename}{file_ext}'
         movie_details = {
+            'tmdb_id': result['id'],
             'new_moviename': new_moviename,
             'new_filename': new_filename,
             'year_dedected': year_dedected
@@ -250,22 +342,33 @@ class MovieIdentify:
         return cleaned_name
 
 
-def main():
-    """ main to lunch moviesort """
+def main(entries=None):
+    """
+    main to lunch moviesort, entries limits to these
+    top level names in movie_downpath, all if None
+    """
     handler = MovieHandler()
+    interrupted = [
+        os.path.basename(path) for path, _ in handler.get_interrupted()
+    ]
     # check if pending
-    if not handler.pending:
+    if not handler.pending and not interrupted:
         print('no movies to sort')
-        return
-    to_rename = handler.move_to_sort()
-    # identify
-    identified = []
-    for i in to_rename:
-        movie = MovieIdentify(i)
-        identified.append(movie)
+        return 0
+    to_rename = handler.move_to_sort(entries) + interrupted
+    handler.sorting = list(to_rename)
+    try:
+        identified = handler.identify(to_rename)
+    except (Exception, KeyboardInterrupt):
+        # not resolved, back to where the next run looks for them
+        handler.move_back(to_rename)
+        raise
     # rename and move
     renamed = handler.rename_files(identified)
+    moved = 0
     if renamed:
         moved = handler.move_to_archive(identified)
         print(f'renamed {moved} movies')
-        handler.cleanup(moved)
+    if renamed or handler.deferred:
+        handler.cleanup(moved, entries)
+    return moved or 0
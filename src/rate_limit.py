@@ -0,0 +1,34 @@
+""" thread safe token bucket to stay below api rate limits """
+
+import threading
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """ allow burst of capacity calls, refilled at rate tokens per second """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.last = monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """ add tokens for time passed since last refill """
+        now = monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last) * self.rate
+        )
+        self.last = now
+
+    def acquire(self):
+        """ block until a token is available and take it """
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
@@ -0,0 +1,78 @@
+""" find media files in the download folders in a single pass """
+
+import os
+from collections import namedtuple
+
+from src.config import get_config
+
+
+Candidate = namedtuple(
+    'Candidate', ['path', 'name', 'size', 'mtime', 'inode', 'ext']
+)
+
+
+class Scanner:
+    """ scandir based scan, stats only files with a media extension """
+
+    CONFIG = get_config()
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.ext = self.CONFIG['media']['ext']
+        self.min_file_size = self.CONFIG['media']['min_file_size']
+
+    @staticmethod
+    def walk(path):
+        """ yield DirEntry of every file below path """
+        to_scan = [path]
+        while to_scan:
+            with os.scandir(to_scan.pop()) as all_entries:
+                for entry in all_entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        to_scan.append(entry.path)
+                    elif entry.is_file():
+                        yield entry
+
+    def scan(self, entries=None):
+        """
+        return list of Candidate to sort, entries limits the scan
+        to these top level names in folder, all if None
+        """
+        if entries is not None:
+            entries = set(entries)
+        candidates = []
+        with os.scandir(self.folder) as top_level:
+            for entry in top_level:
+                if entries is not None and entry.name not in entries:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    all_files = self.walk(entry.path)
+                elif entry.is_file():
+                    all_files = [entry]
+                else:
+                    continue
+                for file_entry in all_files:
+                    candidate = self.get_candidate(file_entry)
+                    if candidate:
+                        candidates.append(candidate)
+        return candidates
+
+    def get_candidate(self, entry):
+        """ build Candidate from DirEntry, None if not a media file """
+        name = entry.name
+        extension = os.path.splitext(name)[1].lstrip('.').lower()
+        if extension not in self.ext or 'sample' in name:
+            return None
+        # cached by DirEntry
+        stat = entry.stat()
+        if stat.st_size <= self.min_file_size:
+            return None
+        candidate = Candidate(
+            path=entry.path,
+            name=name,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            inode=stat.st_ino,
+            ext=extension
+        )
+        return candidate
@@ -0,0 +1,84 @@
+""" shared by the movie and tv sorter """
+
+import os
+
+from src.config import get_config
+from src.scanner import Scanner
+from src.state import StateStore
+from src.transfer import Transfer
+from src.trash import Trash
+
+
+class SortHandler:
+    """
+    move media files from a download folder to sortpath, only files
+    moved by this kind of handler are touched in sortpath
+    """
+
+    CONFIG = get_config()
+    TRANSFER = Transfer()
+    TRASH = Trash()
+    STATE = StateStore()
+    WORKERS = 4
+    # set by subclass: kind in STATE, config key of download folder
+    KIND = None
+    DOWNPATH = None
+
+    def __init__(self):
+        self.candidates = []
+        # filename in sortpath: identity in STATE
+        self.identities = {}
+        self.pending = self.get_pending()
+        # filenames in sortpath to go back to the download folder
+        self.deferred = []
+
+    def get_pending(self):
+        """ return how many media files are pending, keep the scan """
+        downpath = self.CONFIG['media'][self.DOWNPATH]
+        self.candidates = Scanner(downpath).scan()
+        return len(self.candidates)
+
+    def get_interrupted(self):
+        """
+        list of (path, status) of files an interrupted run of this kind
+        left in sortpath
+        """
+        sortpath = self.CONFIG['media']['sortpath']
+        return self.STATE.get_interrupted(self.KIND, sortpath)
+
+    def move_to_sort(self, entries=None):
+        """ move media files to sortpath, all or only from entries """
+        downpath = self.CONFIG['media'][self.DOWNPATH]
+        sortpath = self.CONFIG['media']['sortpath']
+        if entries is None:
+            candidates = self.candidates
+        else:
+            candidates = Scanner(downpath).scan(entries)
+        to_move = [
+            (i.path, os.path.join(sortpath, i.name)) for i in candidates
+        ]
+        self.TRANSFER.move_many(to_move)
+        return [i.name for i in candidates]
+
+    def resume(self, filename):
+        """ remember identity of filename, return details if resolved """
+        sortpath = self.CONFIG['media']['sortpath']
+        identity, details = self.STATE.resume(os.path.join(sortpath, filename))
+        self.identities[filename] = identity
+        return details
+
+    def defer(self, filename):
+        """ keep filename for the next run """
+        self.deferred.append(filename)
+        self.STATE.set(
+            self.identities[filename], self.KIND, filename, 'deferred'
+        )
+
+    def move_back(self, filenames):
+        """ return filenames still in sortpath to the download folder """
+        sortpath = self.CONFIG['media']['sortpath']
+        downpath = self.CONFIG['media'][self.DOWNPATH]
+        self.TRANSFER.move_many([
+            (os.path.join(sortpath, i), os.path.join(downpath, i))
+            for i in filenames if os.path.isfile(os.path.join(sortpath, i))
+        ])
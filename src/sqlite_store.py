@@ -0,0 +1,33 @@
+""" base for the single file sqlite databases in log_folder """
+
+import os
+import sqlite3
+import threading
+
+from src.config import get_config
+
+
+class SqliteStore:
+    """ lazy opened connection shared between threads behind a lock """
+    # pylint: disable=too-few-public-methods
+
+    CONFIG = get_config()
+    # statements run once on connect
+    SCHEMA = ()
+
+    def __init__(self, db_name):
+        log_folder = self.CONFIG['media']['log_folder']
+        self.db_path = os.path.join(log_folder, db_name)
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def connect(self):
+        """ lazy open the database on first use """
+        if self.conn:
+            return self.conn
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        self.conn = conn
+        return conn
@@ -0,0 +1,132 @@
+""" persistent record of every file the sorters processed """
+
+import json
+import os
+from time import time
+
+from src.sqlite_store import SqliteStore
+
+
+class StateStore(SqliteStore):
+    """ single file sqlite store keyed on the identity of a media file """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS files ('
+        'identity TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+        'filename TEXT NOT NULL, status TEXT NOT NULL, media_id TEXT, '
+        'details TEXT, target TEXT, updated REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_status ON files (status)'
+    )
+    # resolved details are only reused from these
+    RESUMABLE = ('resolved', 'renamed')
+
+    def __init__(self, db_name='state.db'):
+        super().__init__(db_name)
+
+    @staticmethod
+    def get_identity(path):
+        """ inode, size and mtime, stays the same on rename """
+        stat = os.stat(path)
+        return f'{stat.st_ino}:{stat.st_size}:{stat.st_mtime}'
+
+    def get(self, identity):
+        """ return record dict or None if never seen """
+        with self.lock:
+            row = self.connect().execute(
+                'SELECT kind, filename, status, media_id, details, target '
+                'FROM files WHERE identity = ?', (identity,)
+            ).fetchone()
+        if not row:
+            return None
+        kind, filename, status, media_id, details, target = row
+        record = {
+            'kind': kind,
+            'filename': filename,
+            'status': status,
+            'media_id': media_id,
+            'details': json.loads(details) if details else None,
+            'target': target
+        }
+        return record
+
+    def resume(self, path):
+        """ return identity of path and details if resolved before """
+        identity = self.get_identity(path)
+        record = self.get(identity)
+        if not record or record['status'] not in self.RESUMABLE:
+            return identity, None
+        return identity, record['details']
+
+    def get_interrupted(self, kind, folder):
+        """
+        list of (path, status) of files of kind resolved or renamed
+        in folder by a run that didn't get to archive them
+        """
+        with self.lock:
+            rows = self.connect().execute(
+                'SELECT identity, filename, status, target FROM files '
+                'WHERE kind = ? AND status IN '
+                f'({", ".join("?" for _ in self.RESUMABLE)})',
+                (kind, *self.RESUMABLE)
+            ).fetchall()
+        folder = os.path.normpath(folder)
+        interrupted = []
+        for identity, filename, status, target in rows:
+            if status == 'renamed':
+                path = target
+            else:
+                path = os.path.join(folder, filename)
+            if os.path.commonpath([folder, path]) != folder:
+                continue
+            try:
+                if self.get_identity(path) != identity:
+                    # different file by the same name
+                    continue
+            except FileNotFoundError:
+                continue
+            interrupted.append((path, status))
+        return interrupted
+
+    def set(self, identity, kind, filename, status, *, media_id=None,
+            details=None):
+        """ add or replace record of identity """
+        # pylint: disable=too-many-arguments
+        details_str = json.dumps(details) if details else None
+        media_id = str(media_id) if media_id is not None else None
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO files '
+                '(identity, kind, filename, status, media_id, details, '
+                'target, updated) VALUES (?, ?, ?, ?, ?, ?, NULL, ?)',
+                (identity, kind, filename, status, media_id, details_str,
+                 time())
+            )
+            conn.commit()
+
+    def update(self, identity, status, target):
+        """ set status and target path of existing record """
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                'UPDATE files SET status = ?, target = ?, updated = ? '
+                'WHERE identity = ?', (status, target, time(), identity)
+            )
+            conn.commit()
+
+    def archived(self, moved):
+        """ list of (identity, new_path) moved to the archive """
+        with self.lock:
+            conn = self.connect()
+            for identity, new_path in moved:
+                try:
+                    # new inode if copied across filesystems
+                    new_identity = self.get_identity(new_path)
+                except FileNotFoundError:
+                    new_identity = identity
+                conn.execute(
+                    'UPDATE OR REPLACE files SET identity = ?, '
+                    'status = ?, target = ?, updated = ? WHERE identity = ?',
+                    (new_identity, 'archived', new_path, time(), identity)
+                )
+            conn.commit()
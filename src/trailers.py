@@ -1,37 +1,182 @@
 """ download trailers found in emby with youtube-dl """
 
+import heapq
+import json
+import logging
 import os
+import random
 import re
+import threading
 
-from time import sleep
+from time import monotonic, sleep, time
 
-import requests
 import yt_dlp as youtube_dl
 
+from src.api_client import EMBY
+from src.atomic_file import write_atomic
 from src.config import get_config
+from src.db_export import EmbyLibrary
+from src.transfer import Transfer
+
+
+class FailedTrailers:
+    """
+    keyed store of failed downloads in log_folder/trailer_failures.json,
+    a failed trailer is skipped for a cooldown doubling with each failure
+    """
+
+    CONFIG = get_config()
+    # seconds, first cooldown and max
+    COOLDOWN = 60 * 60 * 24
+    MAX_COOLDOWN = 180 * COOLDOWN
+
+    def __init__(self):
+        log_folder = self.CONFIG['media']['log_folder']
+        self.store_path = os.path.join(log_folder, 'trailer_failures.json')
+        # legacy plain text ignore log
+        self.log_path = os.path.join(log_folder, 'trailers')
+        # 'youtube_id movie_name': {failures, last_attempt, reason}
+        self.failures = None
+        # of the store file when last read or written
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(youtube_id, movie_name):
+        """ same format as a line of the legacy ignore log """
+        return f'{youtube_id} {movie_name}'
+
+    def get_mtime(self):
+        """ mtime of store file in ns, None if missing """
+        try:
+            return os.stat(self.store_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        read store, again if edited since, import legacy ignore log
+        if no store yet
+        """
+        mtime = self.get_mtime()
+        if self.failures is not None and mtime == self.mtime:
+            return self.failures
+        self.mtime = mtime
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                self.failures = json.load(f)
+            return self.failures
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.failures = {}
+        try:
+            last_attempt = os.path.getmtime(self.log_path)
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                trailer_lines = f.readlines()
+        except FileNotFoundError:
+            return self.failures
+        for trailer_line in trailer_lines:
+            if trailer_line.strip():
+                self.failures[trailer_line.strip()] = {
+                    'failures': 1,
+                    'last_attempt': last_attempt,
+                    'reason': 'imported from ignore log'
+                }
+        return self.failures
+
+    def save(self):
+        """ write store atomically """
+        write_atomic(self.store_path, json.dumps(self.failures, indent=2))
+        self.mtime = self.get_mtime()
+
+    def get_cooldown(self, failures):
+        """ seconds to skip after this many failures """
+        return min(self.COOLDOWN * 2 ** (failures - 1), self.MAX_COOLDOWN)
+
+    def get_cooling(self, now=None):
+        """ set of keys still cooling down """
+        now = now or time()
+        with self.lock:
+            failures = self.load()
+            cooling = {
+                key for key, failure in failures.items()
+                if failure['last_attempt']
+                + self.get_cooldown(failure['failures']) > now
+            }
+        return cooling
+
+    def add(self, youtube_id, movie_name, reason):
+        """ count another failure of trailer """
+        key = self.get_key(youtube_id, movie_name)
+        with self.lock:
+            failures = self.load()
+            failure = failures.get(key, {'failures': 0})
+            failures[key] = {
+                'failures': failure['failures'] + 1,
+                'last_attempt': time(),
+                'reason': reason
+            }
+            self.save()
+
+    def remove(self, trailers):
+        """ forget trailers downloaded after all """
+        with self.lock:
+            failures = self.load()
+            keys = [
+                self.get_key(i['youtube_id'], i['movie_name'])
+                for i in trailers
+            ]
+            keys = [i for i in keys if i in failures]
+            for key in keys:
+                failures.pop(key)
+            if keys:
+                self.save()
 
 
 class TrailerHandler:
     """ holds the trailers """
 
     CONFIG = get_config()
+    TRANSFER = Transfer()
+    TRAILING_PATTERN = re.compile(r'(.*_)([0-9a-zA-Z-_]{11})(-trailer)$')
+    # library state and pending of the last check in this process
+    LAST = {}
+    FAILED = FailedTrailers()
 
     def __init__(self):
         self.pending = self.get_pending()
 
+    def get_state(self):
+        """ cheap summary of everything the pending list depends on """
+        emby_url = self.CONFIG['emby']['emby_url']
+        emby_api_key = self.CONFIG['emby']['emby_api_key']
+        url = (emby_url + '/Trailers?api_key=' + emby_api_key
+               + '&Recursive=True&Limit=0')
+        local_count = EMBY.get_json(url)['TotalRecordCount']
+        # changes with new failures and expired cooldowns
+        ignore = self.FAILED.get_cooling()
+        last = self.LAST.get('state', {})
+        movie_state = EmbyLibrary.get_state('Movie', last.get('movies'))
+        state = {
+            'movies': movie_state,
+            'local_count': local_count,
+            'ignore': ignore,
+            'changed': (movie_state['changed']
+                        or local_count != last.get('local_count')
+                        or ignore != last.get('ignore'))
+        }
+        return state
+
     def get_local_trailers(self):
         """ gets a list of existing trailers on filesystem """
         emby_url = self.CONFIG['emby']['emby_url']
         emby_api_key = self.CONFIG['emby']['emby_api_key']
         url = (emby_url + '/Trailers?api_key=' + emby_api_key
                + '&Recursive=True&Fields=Path')
-        request = requests.get(url).json()
+        request = EMBY.get_json(url)
         local_trailer_list = []
         for movie in request['Items']:
             trailer_name = movie['Name']
-            trailing_reg = r'(.*_)([0-9a-zA-Z-_]{11})(-trailer)$'
-            trailing_pattern = re.compile(trailing_reg)
-            youtube_id = trailing_pattern.findall(trailer_name)[0][1]
+            youtube_id = self.TRAILING_PATTERN.findall(trailer_name)[0][1]
             movie_name = movie['Path'].split('/')[-2]
             trailer_details = {
                 'movie_name': movie_name,
@@ -48,111 +193,238 @@ class TrailerHandler:
         url = (emby_url + '/Items?api_key=' + emby_api_key +
                '&Recursive=True&Fields=RemoteTrailers,Path' +
                '&IncludeItemTypes=Movie')
-        request = requests.get(url).json()
+        request = EMBY.get_json(url)
+        moviepath = self.CONFIG['media']['moviepath']
         remote_trailers_list = []
         for movie in request['Items']:
-            movie_name = movie['Path'].split('/')[-2]
+            try:
+                year, movie_name = movie['Path'].split('/')[-3:-1]
+            except ValueError:
+                # not in a year/movie folder, nowhere to place it
+                logging.warning(
+                    'trailers:skipped, unexpected path [%s]', movie['Path']
+                )
+                continue
+            # same folder in the local archive
+            movie_folder = os.path.join(moviepath, year, movie_name)
             remote_trailers = movie['RemoteTrailers']
             for remote_trailer in remote_trailers:
                 url = remote_trailer['Url']
                 youtube_id = url.split('?v=')[1]
                 trailer_details = {
                     'movie_name': movie_name,
-                    'youtube_id': youtube_id
+                    'youtube_id': youtube_id,
+                    'movie_folder': movie_folder
                 }
                 remote_trailers_list.append(trailer_details)
         return remote_trailers_list
 
-    def get_ignore_trailers(self):
-        """ read log file to get list of trailers to ignore """
-        log_folder = self.CONFIG['media']['log_folder']
-        log_file = os.path.join(log_folder, 'trailers')
-        with open(log_file, 'r', encoding='utf-8') as log_file:
-            trailer_lines = log_file.readlines()
-        ignore_trailer_list = []
-        for trailer_line in trailer_lines:
-            youtube_id = trailer_line.split()[0]
-            movie_name = trailer_line.lstrip(youtube_id).strip()
-            trailer_details = {
-                'movie_name': movie_name,
-                'youtube_id': youtube_id
-            }
-            ignore_trailer_list.append(trailer_details)
-        return ignore_trailer_list
-
     def get_pending(self):
-        """ compare have and pending """
-        remote_trailers_list = self.get_remote_trailers()
-        local_trailer_list = self.get_local_trailers()
-        ignore_trailer_list = self.get_ignore_trailers()
-        # add local and ignore list together
-        have_trailers = ([i['youtube_id'] for i in local_trailer_list]
-                         + [i['youtube_id'] for i in ignore_trailer_list])
-        # add to pending if missing
+        """ compare have and pending, reuse last if nothing changed """
+        state = self.get_state()
+        if not state['changed']:
+            return self.LAST['pending']
+        pending = self.diff_pending(
+            self.get_remote_trailers(), self.get_local_trailers(),
+            state['ignore']
+        )
+        self.LAST.update({'state': state, 'pending': pending})
+        return pending
+
+    @staticmethod
+    def diff_pending(remote_trailers_list, local_trailer_list, ignore):
+        """ remote trailers not local and not in set of ignore keys """
+        # hashed keys of local and cooling down after failing
+        have_trailers = {
+            FailedTrailers.get_key(i['youtube_id'], i['movie_name'])
+            for i in local_trailer_list
+        }
+        have_trailers.update(ignore)
+        # add to pending if missing, once per movie
         pending = []
         for remote_trailer in remote_trailers_list:
-            youtube_id = remote_trailer['youtube_id']
-            if youtube_id not in have_trailers:
+            key = FailedTrailers.get_key(
+                remote_trailer['youtube_id'], remote_trailer['movie_name']
+            )
+            if key not in have_trailers:
+                have_trailers.add(key)
                 pending.append(remote_trailer)
         return pending
 
+    def get_downpath(self):
+        """
+        folder for unfinished and not yet placed trailers, not used by
+        anything else so partial downloads survive until the next run
+        """
+        downpath = self.CONFIG['media'].get('trailer_downpath')
+        if not downpath:
+            log_folder = self.CONFIG['media']['log_folder']
+            downpath = os.path.join(log_folder, 'trailer_downloads')
+        os.makedirs(downpath, exist_ok=True)
+        return downpath
+
     def dl_pending(self):
-        # pylint: disable=broad-except
-        """ download pending trailers """
-        sortpath = self.CONFIG['media']['sortpath']
-        log_folder = self.CONFIG['media']['log_folder']
-        ydl_opts = self.CONFIG['ydl_opts']
-        # loop thrugh list
-        trailers_downloaded = []
+        """
+        download pending trailers to the trailer downpath and move each
+        into its movie folder once done, return list of downloaded
+        """
+        downpath = self.get_downpath()
+        workers = self.CONFIG['media'].get('trailer_workers', 2)
+        to_download = []
         for trailer in self.pending:
             youtube_id = trailer['youtube_id']
             movie_name = trailer['movie_name']
             filename = f'{movie_name}_{youtube_id}-trailer.mkv'
-            filepath = os.path.join(sortpath, filename)
-            ydl_opts['outtmpl'] = filepath
-            # try up to 5 times
-            for i in range(5):
-                try:
-                    print(f'[{i}] {youtube_id} {movie_name}')
-                    url = 'https://www.youtube.com/watch?v=' + youtube_id
-                    youtube_dl.YoutubeDL(ydl_opts).download([url])
-                except KeyboardInterrupt:
-                    return False
-                except Exception:
-                    if i == 4:
-                        # giving up
-                        log_file = os.path.join(log_folder, 'trailers')
-                        with open(log_file, 'a', encoding='utf-8') as f:
-                            f.write(f'{youtube_id} {movie_name}\n')
-                        break
-                    sleep((i + 1) ** 2)
-                    continue
+            to_download.append((trailer, os.path.join(downpath, filename)))
+        queue = DownloadQueue(self.CONFIG['ydl_opts'], workers, self.place)
+        try:
+            downloaded, failed = queue.run(to_download)
+        except KeyboardInterrupt:
+            queue.stop()
+            return False
+        for trailer, reason in failed:
+            # giving up until cooled down, placing too
+            self.FAILED.add(
+                trailer['youtube_id'], trailer['movie_name'], reason
+            )
+        self.FAILED.remove(downloaded)
+        return downloaded
+
+    def place(self, trailer, filepath):
+        """
+        move downloaded trailer into movie folder from emby path,
+        raises OSError if the folder doesn't exist
+        """
+        movie_folder = trailer['movie_folder']
+        new_path = os.path.join(movie_folder, os.path.basename(filepath))
+        try:
+            self.TRANSFER.move(filepath, new_path)
+        except FileNotFoundError as err:
+            raise FileNotFoundError(
+                f'movie folder not found: {movie_folder}'
+            ) from err
+
+
+class DownloadQueue:
+    """
+    download with several workers, one YoutubeDL each, sharing the
+    ydl_opts ratelimit, a failed item waits without blocking a worker
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    RETRIES = 5
+
+    def __init__(self, ydl_opts, workers, place=None):
+        self.workers = max(1, workers)
+        # called with trailer and filepath when downloaded
+        self.place = place
+        self.ydl_opts = dict(ydl_opts)
+        if self.ydl_opts.get('ratelimit'):
+            # bytes per second split between workers
+            self.ydl_opts['ratelimit'] = (
+                self.ydl_opts['ratelimit'] // self.workers
+            )
+        self.cond = threading.Condition()
+        # (not before monotonic, counter, attempt, trailer, filepath)
+        self.waiting = []
+        self.counter = 0
+        self.active = 0
+        self.stopped = False
+        self.downloaded = []
+        self.failed = []
+
+    def run(self, to_download):
+        """
+        list of (trailer, filepath), return downloaded
+        and list of failed (trailer, last error)
+        """
+        for trailer, filepath in to_download:
+            self.put(0, trailer, filepath, 0)
+        threads = [
+            threading.Thread(target=self.worker, daemon=True)
+            for _ in range(min(self.workers, len(to_download)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # short timeout to stay responsive to ctrl + c
+            while thread.is_alive():
+                thread.join(0.5)
+        return self.downloaded, self.failed
+
+    def stop(self):
+        """ let workers exit after the current download """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def put(self, attempt, trailer, filepath, delay):
+        """ add to queue, ready after delay seconds """
+        with self.cond:
+            self.counter = self.counter + 1
+            heapq.heappush(self.waiting, (
+                monotonic() + delay, self.counter, attempt, trailer, filepath
+            ))
+            self.cond.notify()
+
+    def get(self):
+        """ next ready item, wait if all are backing off, None when done """
+        with self.cond:
+            while True:
+                if self.stopped or not (self.waiting or self.active):
+                    return None
+                if self.waiting:
+                    wait = self.waiting[0][0] - monotonic()
+                    if wait <= 0:
+                        self.active = self.active + 1
+                        return heapq.heappop(self.waiting)[2:]
+                    self.cond.wait(wait)
                 else:
-                    trailers_downloaded.append(trailer)
-                    break
-        return trailers_downloaded
+                    self.cond.wait()
 
-    def archive(self):
-        """ move downloaded trailers to movie archive """
-        sortpath = self.CONFIG['media']['sortpath']
-        moviepath = self.CONFIG['media']['moviepath']
+    def worker(self):
+        """ download until queue is empty """
+        # pylint: disable=broad-except
+        ydl = youtube_dl.YoutubeDL(self.ydl_opts)
+        while True:
+            job = self.get()
+            if not job:
+                return
+            attempt, trailer, filepath = job
+            youtube_id = trailer['youtube_id']
+            try:
+                # done in an earlier run, partial files get resumed
+                if not os.path.exists(filepath):
+                    print(f'[{attempt}] {youtube_id} {trailer["movie_name"]}')
+                    ydl.params['outtmpl'] = {'default': filepath}
+                    url = 'https://www.youtube.com/watch?v=' + youtube_id
+                    ydl.download([url])
+            except Exception as err:
+                self.done(job, repr(err))
+                continue
+            if self.place:
+                try:
+                    self.place(trailer, filepath)
+                except OSError as err:
+                    # no point retrying now, download is kept for next time
+                    print(f'failed to place {os.path.basename(filepath)}')
+                    self.done(job, repr(err), retry=False)
+                    continue
+            self.done(job, None)
 
-        new_trailers = os.listdir(sortpath)
-        # loop through new trailers
-        for trailer in new_trailers:
-            # build path
-            year_pattern = re.compile(r'(\()([0-9]{4})(\))')
-            trailing_reg = r'(.*)(_[0-9a-zA-Z-_]{11}-trailer.mkv)$'
-            trailing_pattern = re.compile(trailing_reg)
-            movie_name = trailing_pattern.findall(trailer)[0][0]
-            year = year_pattern.findall(trailer)[0][1]
-            movie_folder = os.path.join(moviepath, year, movie_name)
-            # move if all good
-            if os.path.isdir(movie_folder):
-                old_file = os.path.join(sortpath, trailer)
-                new_file = os.path.join(movie_folder, trailer)
-                os.rename(old_file, new_file)
-        return new_trailers
+    def done(self, job, error, retry=True):
+        """ record result, queue retry with jittered back off """
+        attempt, trailer, filepath = job
+        with self.cond:
+            self.active = self.active - 1
+            if not error:
+                self.downloaded.append(trailer)
+            elif retry and attempt + 1 < self.RETRIES:
+                delay = (attempt + 1) ** 2 * random.uniform(0.5, 1.5)
+                self.put(attempt + 1, trailer, filepath, delay)
+            else:
+                self.failed.append((trailer, error))
+            self.cond.notify_all()
 
 
 def main():
@@ -166,8 +438,10 @@ def main():
         downloaded = False
         print('no missing trailers found')
         sleep(2)
-        return
+        return 0
     if downloaded:
-        new_trailers = handler.archive()
-        print(f'downloaded {len(new_trailers)} new trailers')
+        TrailerHandler.LAST.clear()
+        print(f'downloaded {len(downloaded)} new trailers')
         sleep(2)
+        return len(downloaded)
+    return 0
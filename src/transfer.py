@@ -0,0 +1,116 @@
+""" move files, also across filesystems, several at once """
+
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from src.config import get_config
+
+
+class Transfer:
+    """ rename on same device, else zero-copy copy, verify and unlink """
+
+    CONFIG = get_config()
+    CHUNK = 64 * 1024 * 1024
+    # fall back to next copy method on these
+    FALLBACK_ERRNO = (
+        errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP
+    )
+
+    def __init__(self):
+        self.per_disk = self.CONFIG['media'].get('transfer_workers', 2)
+        self.disk_locks = {}
+        self.lock = threading.Lock()
+
+    def get_disk_lock(self, path):
+        """ semaphore limiting parallel moves to the device of path """
+        device = os.stat(os.path.dirname(path) or '.').st_dev
+        with self.lock:
+            if device not in self.disk_locks:
+                semaphore = threading.BoundedSemaphore(self.per_disk)
+                self.disk_locks[device] = semaphore
+            return self.disk_locks[device]
+
+    def move(self, old_path, new_path):
+        """ move single file or folder, return bytes copied """
+        try:
+            os.rename(old_path, new_path)
+            return 0
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+        if os.path.isdir(old_path):
+            shutil.move(old_path, new_path)
+            return 0
+        with self.get_disk_lock(new_path):
+            start = monotonic()
+            copied = self.copy_file(old_path, new_path)
+            speed = copied / 1024 / 1024 / max(monotonic() - start, 0.001)
+        os.unlink(old_path)
+        print(f'copied {os.path.basename(new_path)} '
+              f'{copied // 1024 // 1024} MB ({speed:.0f} MB/s)')
+        return copied
+
+    def copy_file(self, old_path, new_path):
+        """ copy in kernel space if possible, fsync and verify size """
+        size = os.stat(old_path).st_size
+        tmp_path = new_path + '.part'
+        with open(old_path, 'rb') as f_in, open(tmp_path, 'wb') as f_out:
+            copied = self.copy_range(f_in.fileno(), f_out.fileno(), size)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        if copied != size or os.stat(tmp_path).st_size != size:
+            os.unlink(tmp_path)
+            raise OSError(f'copy failed, size mismatch: {old_path}')
+        shutil.copystat(old_path, tmp_path)
+        os.replace(tmp_path, new_path)
+        return copied
+
+    def copy_range(self, fd_in, fd_out, size):
+        """ copy_file_range, then sendfile, then plain read write """
+        copied = 0
+        for copy_func in (self.copy_file_range, self.sendfile):
+            try:
+                while copied < size:
+                    sent = copy_func(fd_in, fd_out, copied)
+                    if not sent:
+                        break
+                    copied = copied + sent
+                return copied
+            except AttributeError:
+                # not available on this platform
+                continue
+            except OSError as err:
+                if copied or err.errno not in self.FALLBACK_ERRNO:
+                    raise
+        while True:
+            chunk = os.read(fd_in, self.CHUNK)
+            if not chunk:
+                return copied
+            copied = copied + os.write(fd_out, chunk)
+
+    def copy_file_range(self, fd_in, fd_out, offset):
+        """ copy next chunk with copy_file_range, linux only """
+        return os.copy_file_range(
+            fd_in, fd_out, self.CHUNK, offset_src=offset, offset_dst=offset
+        )
+
+    def sendfile(self, fd_in, fd_out, offset):
+        """ copy next chunk with sendfile """
+        return os.sendfile(fd_out, fd_in, offset, self.CHUNK)
+
+    def move_many(self, to_move):
+        """ move list of (old_path, new_path) tuples concurrently """
+        if not to_move:
+            return []
+        done = []
+        workers = min(len(to_move), self.per_disk * 2)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.move, *i) for i in to_move]
+            for (_, new_path), future in zip(to_move, futures):
+                future.result()
+                done.append(new_path)
+        return done
@@ -0,0 +1,204 @@
+""" move files to trash in process, following the freedesktop.org spec """
+
+import os
+import shutil
+import stat
+import subprocess
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+
+from src.config import get_config
+
+
+class Trash:
+    """ trash many paths without one subprocess per path """
+
+    CONFIG = get_config()
+    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+    # only items trashed from these folders get purged
+    PURGE_FOLDERS = ('tv_downpath', 'movie_downpath', 'sortpath',
+                     'moviepath', 'tvpath')
+
+    def __init__(self):
+        self.retention = self.CONFIG['media'].get('trash_retention_days')
+        # st_dev: trash folder
+        self.trash_dirs = {}
+
+    @staticmethod
+    def get_home_trash():
+        """ trash in XDG_DATA_HOME """
+        data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(
+            os.path.expanduser('~'), '.local', 'share'
+        )
+        return os.path.join(data_home, 'Trash')
+
+    @staticmethod
+    def get_mount_point(path):
+        """ top folder of the filesystem path is on """
+        path = os.path.realpath(path)
+        device = os.lstat(path).st_dev
+        while path != os.path.dirname(path):
+            parent = os.path.dirname(path)
+            if os.lstat(parent).st_dev != device:
+                break
+            path = parent
+        return path
+
+    def get_trash_dir(self, path):
+        """ trash folder on the same filesystem as path """
+        device = os.lstat(path).st_dev
+        if device in self.trash_dirs:
+            return self.trash_dirs[device]
+        home_trash = self.get_home_trash()
+        os.makedirs(home_trash, mode=0o700, exist_ok=True)
+        if os.stat(home_trash).st_dev == device:
+            trash_dir = home_trash
+        else:
+            top_dir = self.get_mount_point(path)
+            uid = os.getuid()
+            shared = os.path.join(top_dir, '.Trash')
+            try:
+                shared_stat = os.lstat(shared)
+                usable = (stat.S_ISDIR(shared_stat.st_mode)
+                          and shared_stat.st_mode & stat.S_ISVTX)
+            except FileNotFoundError:
+                usable = False
+            if usable:
+                trash_dir = os.path.join(shared, str(uid))
+            else:
+                trash_dir = os.path.join(top_dir, f'.Trash-{uid}')
+        # mode only applies to the last folder, spec wants 0700 for all
+        os.makedirs(trash_dir, mode=0o700, exist_ok=True)
+        for sub_dir in ('files', 'info'):
+            os.makedirs(
+                os.path.join(trash_dir, sub_dir), mode=0o700, exist_ok=True
+            )
+        self.trash_dirs[device] = trash_dir
+        return trash_dir
+
+    @staticmethod
+    def get_size(path):
+        """ size in bytes of file or folder """
+        if not os.path.isdir(path) or os.path.islink(path):
+            return os.lstat(path).st_size
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                size = size + os.lstat(os.path.join(dirpath, filename)).st_size
+        return size
+
+    def trash(self, path):
+        """ move single path to trash, return bytes """
+        path = os.path.abspath(path)
+        size = self.get_size(path)
+        trash_dir = self.get_trash_dir(path)
+        base_name = os.path.basename(path)
+        info = (
+            '[Trash Info]\n'
+            + f'Path={quote(path)}\n'
+            + f'DeletionDate={datetime.now().strftime(self.DATE_FORMAT)}\n'
+        )
+        # reserve unique name by creating the info file first
+        counter = 1
+        name = base_name
+        while True:
+            info_path = os.path.join(trash_dir, 'info', f'{name}.trashinfo')
+            try:
+                fd = os.open(info_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                break
+            except FileExistsError:
+                counter = counter + 1
+                name = f'{base_name}.{counter}'
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(info)
+        try:
+            os.rename(path, os.path.join(trash_dir, 'files', name))
+        except OSError:
+            os.unlink(info_path)
+            raise
+        return size
+
+    def trash_many(self, paths):
+        """ trash all paths, return bytes removed from their folders """
+        trashed = 0
+        failed = []
+        for path in paths:
+            try:
+                trashed = trashed + self.trash(path)
+            except OSError:
+                failed.append(path)
+        if failed:
+            # one trash-cli call for all left over
+            try:
+                returncode = subprocess.call(['trash'] + failed)
+            except FileNotFoundError:
+                print('trash-cli not installed')
+                returncode = None
+            if returncode != 0:
+                print('failed to trash, left in place:')
+                for path in failed:
+                    print(path)
+        if self.retention is not None:
+            self.purge()
+        return trashed
+
+    def get_purge_folders(self):
+        """ absolute media folders from config """
+        return [
+            os.path.abspath(self.CONFIG['media'][i])
+            for i in self.PURGE_FOLDERS if self.CONFIG['media'].get(i)
+        ]
+
+    def purge(self):
+        """
+        delete items older than retention days from used trash dirs,
+        only if trashed from one of the media folders
+        """
+        oldest = datetime.now() - timedelta(days=self.retention)
+        folders = self.get_purge_folders()
+        purged = 0
+        for trash_dir in self.trash_dirs.values():
+            info_dir = os.path.join(trash_dir, 'info')
+            for info_name in os.listdir(info_dir):
+                info_path = os.path.join(info_dir, info_name)
+                trash_info = self.read_info(info_path)
+                deleted = trash_info.get('DeletionDate')
+                if not deleted or deleted > oldest:
+                    continue
+                original = trash_info.get('Path', '')
+                if not any(original.startswith(i + os.sep) for i in folders):
+                    # not ours
+                    continue
+                name = info_name[:-len('.trashinfo')]
+                path = os.path.join(trash_dir, 'files', name)
+                if os.path.lexists(path):
+                    purged = purged + self.get_size(path)
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.unlink(path)
+                os.unlink(info_path)
+        if purged:
+            print(f'purged {purged // 1024 // 1024} MB from trash')
+        return purged
+
+    def read_info(self, info_path):
+        """ parse Path and DeletionDate from trashinfo file """
+        trash_info = {}
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except (OSError, UnicodeDecodeError):
+            return trash_info
+        for line in lines:
+            key, _, value = line.strip().partition('=')
+            if key == 'Path':
+                trash_info['Path'] = unquote(value)
+            elif key == 'DeletionDate':
+                try:
+                    trash_info['DeletionDate'] = datetime.strptime(
+                        value, self.DATE_FORMAT
+                    )
+                except ValueError:
+                    pass
+        return trash_info
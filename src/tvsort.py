@@ -1,80 +1,107 @@
 """ handles moving tv downloads """
 
+import json
 import logging
 import os
 import re
-import subprocess
-from time import sleep
-
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
+from src.api_client import TVMAZE
+from src.atomic_file import write_atomic
+from src.batch import Batch, Deferred
+from src.cache import ResponseCache
 from src.config import get_config
+from src.match_score import MatchScore
+from src.sort_handler import SortHandler
 
 
 class Static:
     """ staticmethods collection used from EpisodeIdentify """
 
+    CACHE = ResponseCache()
+    # cache ttl in seconds by last segment of endpoint
+    DAY = 60 * 60 * 24
+    TTL = {
+        'shows': 7 * DAY,
+        'episodes': DAY,
+        'episodebynumber': 30 * DAY,
+        'episodesbydate': DAY,
+        'ended': 365 * DAY
+    }
+
+    # tried in order of priority, first search hit wins
+    EPISODE_PATTERNS = [
+        # S01E01-E02
+        ('multi', re.compile(
+            r'[sS](?P<season>[0-9]{1,3})[eE](?P<episode>[0-9]{1,3})'
+            r'-?[eE](?P<episode_2>[0-9]{1,3})'
+        )),
+        # S01E01
+        ('se', re.compile(
+            r'[sS](?P<season>[0-9]{1,3}) ?[eE](?P<episode>[0-9]{1,3})'
+        )),
+        # YYYY.MM.DD
+        ('year', re.compile(
+            r'(?P<year>[0-9]{4}).(?P<month>[0-9]{2}).(?P<day>[0-9]{2})'
+        )),
+        # 01X01
+        ('se', re.compile(
+            r'(?P<season>0?[0-9])[xX](?P<episode>[0-9]{1,2})'
+        )),
+        # S01*E01
+        ('se', re.compile(
+            r'[sS](?P<season>[0-9]{1,3})[. ]?[eE](?P<episode>[0-9]{1,3})'
+        )),
+    ]
+    YEAR_PATTERN = re.compile(r'\(?[0-9]{4}\)?')
+    HTML_TAG_PATTERN = re.compile(r'<[^<]+?>')
+
     @staticmethod
-    def split_file_name(filename):
+    def parse_file_name(filename):
         """
-        takes the file name, returns showname, season, episode and id_style
-        based on regex match
+        takes the file name, returns dict with showname, season, episode,
+        episode_list, date, season_id, id_style and span of the match
         """
-        multi_reg = r'[sS][0-9]{1,3}[eE][0-9]{1,3}-?[eE][0-9]{1,3}'
-        if re.compile(multi_reg).findall(filename):
-            # S01E01-02
-            season_id_pattern = re.compile(multi_reg)
-            season_id = season_id_pattern.findall(filename)[0]
-            get_s_nr = re.compile(r'[0-9]{1,3}')
-            season = str(get_s_nr.findall(season_id)[0])
-            e_list = get_s_nr.findall(season_id)[1:]
-            episode = ' '.join(e_list)
-            id_style = 'multi'
-        elif re.compile(r'[sS][0-9]{1,3} ?[eE][0-9]{1,3}').findall(filename):
-            # S01E01
-            season_id_pattern = re.compile(r'[sS]\d{1,3} ?[eE]\d{1,3}')
-            season_id = season_id_pattern.findall(filename)[0]
-            get_s_nr = re.compile(r'[0-9]{1,3}')
-            season = str(get_s_nr.findall(season_id)[0])
-            episode = str(get_s_nr.findall(season_id)[1])
-            id_style = 'se'
-        elif re.compile(r'[0-9]{4}.[0-9]{2}.[0-9]{2}').findall(filename):
-            # YYYY.MM.DD
-            season_id_pattern = re.compile(r'[0-9]{4}.[0-9]{2}.[0-9]{2}')
-            season_id = season_id_pattern.findall(filename)[0]
-            season = "NA"
-            episode = "NA"
-            id_style = 'year'
-        elif re.compile(r'0?[0-9][xX][0-9]{1,2}').findall(filename):
-            # 01X01
-            season_id_pattern = re.compile(r'0?[0-9][xX][0-9]{2}')
-            season_id = season_id_pattern.findall(filename)[0]
-            get_s_nr = re.compile(r'[0-9]{1,3}')
-            season = str(get_s_nr.findall(season_id)[0])
-            episode = str(get_s_nr.findall(season_id)[1])
-            id_style = 'se'
-        elif re.compile(r'[sS][0-9]{1,3}[. ]?[eE][0-9]{1,3}').findall(filename):
-            # S01*E01
-            season_id_pattern = re.compile(r'[sS]\d{1,3}[. ]?[eE]\d{1,3}')
-            season_id = season_id_pattern.findall(filename)[0]
-            get_s_nr = re.compile(r'[0-9]{1,3}')
-            season = str(get_s_nr.findall(season_id)[0])
-            episode = str(get_s_nr.findall(season_id)[1])
-            id_style = 'se'
+        for id_style, pattern in Static.EPISODE_PATTERNS:
+            matched = pattern.search(filename)
+            if matched:
+                break
         else:
             # id syle not dealt with
             print('season episode id failed for:')
             print(filename)
             raise ValueError
-        return season, episode, season_id, id_style
+        groups = matched.groupdict()
+        date = None
+        if id_style == 'year':
+            season = 'NA'
+            episode_list = ['NA']
+            date = f'{groups["year"]}-{groups["month"]}-{groups["day"]}'
+        else:
+            season = groups['season']
+            episode_list = [groups['episode']]
+            if id_style == 'multi':
+                episode_list.append(groups['episode_2'])
+        span = matched.span()
+        file_name_parsed = {
+            'showname': filename[:span[0]],
+            'season': season,
+            'episode': ' '.join(episode_list),
+            'episode_list': episode_list,
+            'date': date,
+            'season_id': matched.group(),
+            'id_style': id_style,
+            'span': span
+        }
+        return file_name_parsed
 
     @staticmethod
     def showname_encoder(showname):
         """ encodes showname for best possible match """
         # tvmaze doesn't like years in showname
         showname = showname.strip().rstrip('-').rstrip(".").strip().lower()
-        year_pattern = re.compile(r'\(?[0-9]{4}\)?')
-        year = year_pattern.findall(showname)
+        year = Static.YEAR_PATTERN.findall(showname)
         if year and year[0] != showname:
             showname = showname.rstrip(year[0]).strip()
         # find acronym
@@ -91,68 +118,155 @@ class Static:
         return encoded
 
     @staticmethod
-    def tvmaze_request(url):
-        """ call the api with back_off on rate limit and user-agent """
-        headers = {
-            'User-Agent': 'https://github.com/bbilly1/media_organizer'
-        }
-        # retry up to 5 times
-        for i in range(5):
-            response = requests.get(url, headers=headers)
-            if response.ok:
-                # all good
-                break
-            if response.status_code == 429:
-                # rate limited
-                print('hit tvmaze rate limiting, slowing down')
-            else:
-                # general fail
-                print('request failed with url:\n' + url)
-            # slow down
-            back_off = (i + 1) ** 2
-            sleep(back_off)
+    def get_ttl(url, status=None):
+        """ cache ttl for url, ended shows don't change any more """
+        if status == 'Ended' and '/shows/' in url:
+            return Static.TTL['ended']
+        endpoint = urlsplit(url).path.rstrip('/').split('/')[-1]
+        return Static.TTL.get(endpoint, Static.DAY)
+
+    @staticmethod
+    def tvmaze_request(url, status=None):
+        """ call the api through cache and shared tvmaze client """
+        cached = Static.CACHE.get(url)
+        if cached is not None:
+            return cached
+        response = TVMAZE.get(url)
         request = response.json()
+        if response.ok:
+            Static.CACHE.set(url, request, Static.get_ttl(url, status))
         return request
 
 
+class EpisodeIndex:
+    """ full episode list of a show, fetched once per show """
+
+    def __init__(self, show_id, status=None):
+        self.show_id = show_id
+        self.status = status
+        self.by_number = {}
+        self.by_date = {}
+        self.build_index()
+
+    def build_index(self):
+        """ index all episodes by season, number and by airdate """
+        url = f'https://api.tvmaze.com/shows/{self.show_id}/episodes'
+        all_episodes = Static.tvmaze_request(url, self.status)
+        for episode in all_episodes:
+            if episode['number'] is not None:
+                key = (int(episode['season']), int(episode['number']))
+                self.by_number[key] = episode
+            if episode['airdate']:
+                self.by_date.setdefault(episode['airdate'], []).append(episode)
+
+    def get_by_number(self, season, number):
+        """
+        return episode dict, fall back to api if not in index,
+        raise LookupError if tvmaze doesn't know it
+        """
+        episode = self.by_number.get((int(season), int(number)))
+        if episode:
+            return episode
+        url = (f'http://api.tvmaze.com/shows/{self.show_id}/episodebynumber?'
+               f'season={season}&number={number}')
+        episode = Static.tvmaze_request(url, self.status)
+        if 'season' not in episode:
+            # 404 error dict
+            raise LookupError(f'episode not found: S{season}E{number}')
+        return episode
+
+    def get_by_date(self, airdate):
+        """
+        return list of episodes aired at date YYYY-MM-DD,
+        raise LookupError if there are none
+        """
+        episodes = self.by_date.get(airdate)
+        if episodes:
+            return episodes
+        url = (f'https://api.tvmaze.com/shows/{self.show_id}/episodesbydate?'
+               f'date={airdate}')
+        episodes = Static.tvmaze_request(url, self.status)
+        if not isinstance(episodes, list) or not episodes:
+            # 404 error dict
+            raise LookupError(f'episode not found: {airdate}')
+        return episodes
+
+
+class ShowResolver:
+    """ known shows keyed on encoded showname, persisted between runs """
+
+    CONFIG = get_config()
+
+    def __init__(self):
+        log_folder = self.CONFIG['media']['log_folder']
+        self.file_path = os.path.join(log_folder, 'tvshows.json')
+        self.shows = self.load()
+
+    def load(self):
+        """ read past picks from disk """
+        try:
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                shows = json.load(f)
+        except FileNotFoundError:
+            shows = {}
+        return shows
+
+    def get(self, showname):
+        """ return show dict or None if not yet resolved """
+        return self.shows.get(showname)
+
+    def add(self, showname, show_id, showname_clean, status):
+        """ remember pick for showname """
+        self.shows[showname] = {
+            'show_id': show_id,
+            'showname_clean': showname_clean,
+            'status': status
+        }
+
+    def save(self):
+        """ write picks to disk """
+        write_atomic(
+            self.file_path, json.dumps(self.shows, indent=2, sort_keys=True)
+        )
+
+
 class Episode:
-    """ describes single episode """
+    """ describes single episode, identified by TvHandler """
+    # pylint: disable=too-many-instance-attributes
 
-    def __init__(self, filename, discovered):
+    SCORER = MatchScore()
+
+    def __init__(self, filename, discovered, episode_indexes=None):
         self.filename = filename
-        self.discovered = discovered
+        if episode_indexes is None:
+            episode_indexes = {}
+        self.episode_indexes = episode_indexes
         self.file_parsed = self.parse_filename()
 
-        showname = self.file_parsed['showname']
-        show_id = None
-        showname_clean = None
-        for i in discovered:
-            if showname == i['showname']:
-                # found it
-                show_id = i['show_id']
-                showname_clean = i['showname_clean']
-                break
-        if not show_id and not showname_clean:
-            self.all_results = self.get_show_id()
+        self.all_results = []
+        self.episode_details = None
 
-        self.episode_details = self.get_ep_details(show_id, showname_clean)
+        showname = self.file_parsed['showname']
+        self.show_id = None
+        self.showname_clean = None
+        self.status = None
+        show = discovered.get(showname)
+        if show:
+            # found it
+            self.show_id = show['show_id']
+            self.showname_clean = show['showname_clean']
+            self.status = show['status']
 
     def parse_filename(self):
         """ parse the file name into its parts """
         filename = self.filename
-        season, episode, season_id, id_style = Static.split_file_name(filename)
-        showname = filename.split(season_id)[0]
+        file_parsed = Static.parse_file_name(filename)
+        showname = file_parsed['showname']
         if 'aka' in showname.lower().split():
             showname = showname.lower().split('aka')[0]
-        # build file_parsed dict
-        file_parsed = {
-            'season': season,
-            'episode': episode,
-            'season_id': season_id,
-            'id_style': id_style,
-            'showname': Static.showname_encoder(showname),
-            'ext': os.path.splitext(filename)[1]
-        }
+        # add to file_parsed dict
+        file_parsed['showname'] = Static.showname_encoder(showname)
+        file_parsed['ext'] = os.path.splitext(filename)[1]
         # return dict
         return file_parsed
 
@@ -167,7 +281,7 @@ class Episode:
             desc_raw = result['show']['summary']
             # filter out basic html tags
             try:
-                desc = re.sub('<[^<]+?>', '', desc_raw)
+                desc = Static.HTML_TAG_PATTERN.sub('', desc_raw)
             except TypeError:
                 desc = desc_raw
             result_dict = {
@@ -175,6 +289,7 @@ class Episode:
                 'show_id': result['show']['id'],
                 'showname_clean': result['show']['name'],
                 'status': result['show']['status'],
+                'weight': result['show'].get('weight'),
                 'desc': desc
             }
             all_results.append(result_dict)
@@ -182,34 +297,28 @@ class Episode:
         return all_results
 
     def pick_show_id(self):
-        """ simple menu to pick matching show manually """
+        """ pick matching show, auto if confident, else menu """
         all_results = self.all_results
         filename = self.filename
         # more than one possibility
         if len(all_results) > 1:
-            print(f'\nfilename: {filename}')
-            # print menu
-            for i in all_results:
-                list_id = i['list_id']
-                showname_clean = i['showname_clean']
-                message = f'[{list_id}] {showname_clean}'
-                print(message)
-            print('[?] show more\n')
-            # select
-            select = input('select: ')
-            # long menu with desc
-            if select == '?':
-                # print menu
-                for i in all_results[:5]:
-                    list_id = i['list_id']
-                    showname_clean = i['showname_clean']
-                    status = i['status']
-                    desc = i['desc']
-                    message = (f'[{list_id}] {showname_clean},'
-                               + f'status: {status}\n{desc}\n')
-                    print(message)
-                # select
-                select = input('select: ')
+            showname = self.file_parsed['showname']
+            scores = [
+                self.SCORER.score_show(showname, i) for i in all_results
+            ]
+            select = self.SCORER.auto_pick(scores)
+            how = 'auto'
+            if select is None:
+                candidates = [i['showname_clean'] for i in all_results]
+                select = Batch.ambiguous('tv', filename, candidates, scores)
+                how = Batch.on_ambiguous
+            if select is None:
+                select = self.show_menu(scores)
+                how = 'manual'
+            self.SCORER.log_decision(
+                'tv', filename, how,
+                all_results[int(select)]['showname_clean'], scores
+            )
         else:
             # only one possibility
             select = 0
@@ -217,13 +326,49 @@ class Episode:
         index = int(select)
         show_id = all_results[index]['show_id']
         showname_clean = all_results[index]['showname_clean']
+        self.status = all_results[index]['status']
         # return tuble
         return show_id, showname_clean
 
-    def get_ep_details(self, show_id=None, showname_clean=None):
+    def show_menu(self, scores):
+        """ simple menu to pick matching show manually """
+        all_results = self.all_results
+        print(f'\nfilename: {self.filename}')
+        # print menu
+        for i in all_results:
+            list_id = i['list_id']
+            showname_clean = i['showname_clean']
+            score = scores[list_id]
+            message = f'[{list_id}] {showname_clean} ({score})'
+            print(message)
+        print('[?] show more\n')
+        # select
+        select = input('select: ')
+        # long menu with desc
+        if select == '?':
+            # print menu
+            for i in all_results[:5]:
+                list_id = i['list_id']
+                showname_clean = i['showname_clean']
+                status = i['status']
+                desc = i['desc']
+                message = (f'[{list_id}] {showname_clean},'
+                           + f'status: {status}\n{desc}\n')
+                print(message)
+            # select
+            select = input('select: ')
+        return select
+
+    def set_show(self, show_id, showname_clean, status):
+        """ set show as picked for another episode of the same show """
+        self.show_id = show_id
+        self.showname_clean = showname_clean
+        self.status = status
+
+    def get_ep_details(self):
         """ build the show details dict"""
-        if not show_id and not showname_clean:
-            show_id, showname_clean = self.pick_show_id()
+        show_id = self.show_id
+        showname_clean = self.showname_clean
         season, episode, episode_name = self.get_episode_name(show_id)
         episode_details = {
             'show_id': show_id,
@@ -234,17 +379,23 @@ class Episode:
         }
         return episode_details
 
+    def get_episode_index(self, show_id):
+        """ get shared EpisodeIndex of show, build on first use """
+        if show_id not in self.episode_indexes:
+            index = EpisodeIndex(show_id, self.status)
+            self.episode_indexes[show_id] = index
+        return self.episode_indexes[show_id]
+
     def multi_parser(self, show_id):
         """ parse multi episode files names for get_episode_name() """
         file_parsed = self.file_parsed
         season = file_parsed['season']
-        episode_list = file_parsed['episode'].split()
+        episode_list = file_parsed['episode_list']
+        episode_index = self.get_episode_index(show_id)
         # loop through all episodes
         episode_name_list = []
         for episode in episode_list:
-            url = (f'http://api.tvmaze.com/shows/{show_id}/episodebynumber?'
-                   f'season={season}&number={episode}')
-            request = Static.tvmaze_request(url)
+            request = episode_index.get_by_number(season, episode)
             episode_name = request['name']
             episode_name_list.append(episode_name)
 
@@ -261,22 +412,17 @@ class Episode:
             # build and return tuple on multi episode
             season, episode, episode_name = self.multi_parser(show_id)
             return season, episode, episode_name
+        episode_index = self.get_episode_index(show_id)
         # season - episode based
         if id_style == 'se':
             season = file_parsed['season']
             episode = file_parsed['episode']
-            url = (f'http://api.tvmaze.com/shows/{show_id}/episodebynumber?'
-                   f'season={season}&number={episode}')
-            request = Static.tvmaze_request(url)
+            request = episode_index.get_by_number(season, episode)
             # returns a dict
             show_response = request
-        # date based
-        elif id_style == 'year':
-            date_raw = file_parsed['season_id']
-            year, month, day = date_raw.split('.')
-            url = (f'https://api.tvmaze.com/shows/{show_id}/episodesbydate?'
-                   f'date={year}-{month}-{day}')
-            request = Static.tvmaze_request(url)
+        # date based, id_style year
+        else:
+            request = episode_index.get_by_date(file_parsed['date'])
             # returns a list
             show_response = request[0]
         # build and return tuple
@@ -286,60 +432,146 @@ class Episode:
         return season, episode, episode_name
 
 
-class TvHandler:
+class TvHandler(SortHandler):
     """ handles the tv sort classes """
 
-    CONFIG = get_config()
+    KIND = 'tv'
+    DOWNPATH = 'tv_downpath'
 
     def __init__(self):
-        self.pending = self.get_pending()
-        self.discovered = []
-
-    def get_pending(self):
-        """ return how many shows are pending """
-        tv_downpath = self.CONFIG['media']['tv_downpath']
-        pending = len(os.listdir(tv_downpath))
-        return pending
-
-    def move_to_sort(self):
-        """ move tv files to sortpath """
-        tv_downpath = self.CONFIG['media']['tv_downpath']
-        ext = self.CONFIG['media']['ext']
-        min_file_size = self.CONFIG['media']['min_file_size']
-        sortpath = self.CONFIG['media']['sortpath']
-        # walk through tv_downpath
-        for dirpath, _, filenames in os.walk(tv_downpath):
-            for filename in filenames:
-                path = os.path.join(dirpath, filename)
-                _, extension = os.path.splitext(path)
-                extension = extension.lstrip('.').lower()
-                f_size = os.stat(path).st_size
-                if (extension in ext and
-                        'sample' not in filename and
-                        f_size > min_file_size):
-                    move_to = os.path.join(sortpath, filename)
-                    os.rename(path, move_to)
-        pending = sorted(os.listdir(sortpath))
-        return pending
+        super().__init__()
+        self.discovered = ShowResolver()
+        self.episode_indexes = {}
 
     def episode_identify(self, to_rename):
-        """ loops through the pending list """
-        identified = []
+        """
+        identify the pending list in two phases: search all unknown shows
+        concurrently, then ask for all ambiguous picks in one batch
+        """
+        parsed, resumed = self.parse_all(to_rename)
+        to_search = self.search_shows(parsed)
+        picked = self.pick_shows(to_search)
+        identified = self.apply_picks(parsed, picked)
+        resolved = self.resolve_episodes(identified)
+        for episode in resumed:
+            print(f'{episode.filename} (resumed)')
+        return resolved + resumed
+
+    def parse_all(self, to_rename):
+        """
+        return list of parsed Episode and list of Episode resolved in an
+        earlier run, defer files not parsable
+        """
+        parsed = []
+        resumed = []
         for filename in to_rename:
-            episode = Episode(filename, self.discovered)
-            # add to discovered
+            episode_details = self.resume(filename)
+            try:
+                episode = Episode(
+                    filename, self.discovered, self.episode_indexes
+                )
+            except ValueError:
+                if Batch.on_ambiguous == 'ask':
+                    raise
+                Batch.defer('tv', filename, 'season episode id failed')
+                self.defer(filename)
+                continue
+            if episode_details:
+                episode.set_show(
+                    episode_details['show_id'],
+                    episode_details['showname_clean'], episode.status
+                )
+                episode.episode_details = episode_details
+                resumed.append(episode)
+            else:
+                parsed.append(episode)
+        return parsed, resumed
+
+    def search_shows(self, parsed):
+        """ search unknown shows concurrently, one Episode per showname """
+        to_search = {}
+        for episode in parsed:
             showname = episode.file_parsed['showname']
-            showname_clean = episode.episode_details['showname_clean']
-            discovered_item = {
-                'showname': showname,
-                'showname_clean': showname_clean,
-                'show_id': episode.episode_details['show_id']
-            }
-            self.discovered.append(discovered_item)
+            if not episode.show_id and showname not in to_search:
+                to_search[showname] = episode
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            all_results = executor.map(
+                lambda i: i.get_show_id(), to_search.values()
+            )
+            for episode, results in zip(to_search.values(), all_results):
+                episode.all_results = results
+        return to_search
+
+    def pick_shows(self, to_search):
+        """ batch pick ambiguous, return showname: picked Episode """
+        picked = {}
+        for showname, episode in to_search.items():
+            if not episode.all_results:
+                if Batch.on_ambiguous == 'ask':
+                    raise LookupError(f'no show found for: {showname}')
+                # all episodes of showname get deferred in apply_picks
+                Batch.defer('tv', episode.filename, 'no show found')
+                continue
+            try:
+                show_id, showname_clean = episode.pick_show_id()
+            except Deferred:
+                continue
+            episode.set_show(show_id, showname_clean, episode.status)
+            self.discovered.add(
+                showname, show_id, showname_clean, episode.status
+            )
+            picked[showname] = episode
+        if picked:
+            self.discovered.save()
+        return picked
+
+    def apply_picks(self, parsed, picked):
+        """ set picked show for all episodes of it, defer the rest """
+        identified = []
+        for episode in parsed:
+            if not episode.show_id:
+                showname = episode.file_parsed['showname']
+                show = picked.get(showname)
+                if not show:
+                    self.defer(episode.filename)
+                    continue
+                episode.set_show(
+                    show.show_id, show.showname_clean, show.status
+                )
             identified.append(episode)
-            print(filename)
         return identified
 
+    def resolve_episodes(self, identified):
+        """
+        prefetch one episode list per show, then resolve episodes,
+        return resolved, defer episodes tvmaze doesn't know
+        """
+        resolved = []
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            shows = {i.show_id: i for i in identified}
+            list(executor.map(
+                lambda i: i.get_episode_index(i.show_id), shows.values()
+            ))
+            futures = [executor.submit(i.get_ep_details) for i in identified]
+            for episode, future in zip(identified, futures):
+                try:
+                    episode_details = future.result()
+                except LookupError as err:
+                    if Batch.on_ambiguous == 'ask':
+                        raise
+                    Batch.defer('tv', episode.filename, str(err))
+                    self.defer(episode.filename)
+                    continue
+                episode.episode_details = episode_details
+                resolved.append(episode)
+                self.STATE.set(
+                    self.identities[episode.filename], self.KIND,
+                    episode.filename, 'resolved',
+                    media_id=episode.show_id, details=episode_details
+                )
+                print(episode.filename)
+        return resolved
+
     def episode_rename(self, identified):
         """ make folder and rename files as identified """
         sortpath = self.CONFIG['media']['sortpath']
@@ -364,57 +596,93 @@ class TvHandler:
             os.rename(old_file, new_file)
             # finish up
             renamed.append(new_file)
+            self.STATE.update(
+                self.identities[episode.filename], 'renamed', new_file
+            )
             logging.info(
                 'tv:from [%s] to [%s]', episode.filename, new_file_name
             )
         return renamed
 
-    def move_to_archive(self):
+    def move_to_archive(self, renamed):
         """ moves the renamed files to the archive """
         sortpath = self.CONFIG['media']['sortpath']
         tvpath = self.CONFIG['media']['tvpath']
         print()
-        for dirpath, _, filenames in os.walk(sortpath):
-            for show in sorted(filenames):
-                print(show)
-        input('\ncontinue?')
+        for show in sorted(os.path.basename(i) for i in renamed):
+            print(show)
+        Batch.confirm('\ncontinue?')
         # apply
-        for dirpath, _, filenames in os.walk(sortpath):
-            for show in filenames:
-                # make folders
-                folder_name = dirpath.lstrip(sortpath)
-                new_folder = os.path.join(tvpath, folder_name)
-                os.makedirs(new_folder, exist_ok=True)
-                # move file
-                old_file = os.path.join(sortpath, dirpath, show)
-                new_file = os.path.join(new_folder, show)
-                os.rename(old_file, new_file)
-
-    def clean_up(self):
-        """ clean up download and sort folder """
+        to_move = []
+        for old_file in renamed:
+            # make folders
+            folder_name = os.path.relpath(os.path.dirname(old_file), sortpath)
+            new_folder = os.path.join(tvpath, folder_name)
+            os.makedirs(new_folder, exist_ok=True)
+            # move file
+            new_file = os.path.join(new_folder, os.path.basename(old_file))
+            to_move.append((old_file, new_file))
+        identities = [self.STATE.get_identity(i[0]) for i in to_move]
+        self.TRANSFER.move_many(to_move)
+        self.STATE.archived(
+            [(i, new_file) for i, (_, new_file) in zip(identities, to_move)]
+        )
+
+    def clean_up(self, archived, entries=None):
+        """
+        clean up download folder or only its entries and the folders
+        of archived in sortpath
+        """
         sortpath = self.CONFIG['media']['sortpath']
         tv_downpath = self.CONFIG['media']['tv_downpath']
-        to_clean_list = os.listdir(sortpath)
-        for to_clean in to_clean_list:
-            to_trash = os.path.join(sortpath, to_clean)
-            subprocess.call(["trash", to_trash])
-        to_clean_list = os.listdir(tv_downpath)
-        for to_clean in to_clean_list:
-            to_trash = os.path.join(tv_downpath, to_clean)
-            subprocess.call(["trash", to_trash])
-
-
-def main():
-    """ main function to sort tv shows """
+        to_clean_list = entries
+        if to_clean_list is None:
+            to_clean_list = os.listdir(tv_downpath)
+        to_trash = [os.path.join(tv_downpath, i) for i in to_clean_list]
+        trashed = self.TRASH.trash_many(to_trash)
+        # keep deferred for next run
+        self.move_back(self.deferred)
+        # season and show folders, if now empty
+        for folder in {os.path.dirname(i) for i in archived}:
+            while folder != os.path.normpath(sortpath):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    break
+                folder = os.path.dirname(folder)
+        print(f'moved {trashed // 1024 // 1024} MB to trash')
+
+
+def main(entries=None):
+    """
+    main function to sort tv shows, entries limits to these
+    top level names in tv_downpath, all if None
+    """
     handler = TvHandler()
-    if not handler.pending:
+    interrupted = handler.get_interrupted()
+    if not handler.pending and not interrupted:
         print('no tvshows to sort')
-        return
-    to_rename = handler.move_to_sort()
+        return 0
+    to_rename = handler.move_to_sort(entries)
+    to_rename.extend(
+        os.path.basename(path) for path, status in interrupted
+        if status == 'resolved'
+    )
+    renamed = []
     if to_rename:
-        identified = handler.episode_identify(to_rename)
+        try:
+            identified = handler.episode_identify(sorted(to_rename))
+        except (Exception, KeyboardInterrupt):
+            # not resolved, back to where the next run looks for them
+            handler.move_back(to_rename)
+            raise
         renamed = handler.episode_rename(identified)
-    if renamed:
-        handler.move_to_archive()
+    to_archive = renamed + [
+        path for path, status in interrupted if status == 'renamed'
+    ]
+    if to_archive:
+        handler.move_to_archive(to_archive)
         print(f'renamed {len(renamed)} tv episodes')
-        handler.clean_up()
+    if to_archive or handler.deferred:
+        handler.clean_up(to_archive, entries)
+    return len(renamed)
@@ -0,0 +1,196 @@
+""" watch download folders and sort new downloads once complete """
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import sys
+from contextlib import redirect_stdout
+from time import monotonic, sleep
+
+from src.batch import Batch
+from src.config import get_config
+from src.scanner import Scanner
+
+from src import moviesort
+from src import tvsort
+
+
+class Inotify:
+    """ minimal inotify through ctypes, only used to wake up early """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    # no IN_MODIFY, would wake up on every write of a running download
+    MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE)
+    EVENT_SIZE = struct.calcsize('iIII')
+
+    def __init__(self):
+        self.fd = None
+        self.libc = None
+        lib_name = ctypes.util.find_library('c')
+        if not lib_name:
+            return
+        try:
+            libc = ctypes.CDLL(lib_name, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.libc = libc
+            self.fd = fd
+
+    def add_watch(self, path):
+        """ watch folder, adding the same folder twice is a no-op """
+        if self.fd is None:
+            return
+        self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), self.MASK
+        )
+
+    def wait(self, timeout):
+        """ block until any event or timeout, poll if not available """
+        if self.fd is None:
+            sleep(timeout)
+            return
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            self.drain()
+
+    def drain(self):
+        """ read and discard all pending events """
+        while True:
+            try:
+                if not os.read(self.fd, 64 * self.EVENT_SIZE + 4096):
+                    return
+            except BlockingIOError:
+                return
+
+
+class FolderWatch:
+    """ track top level entries of a folder until they are stable """
+
+    def __init__(self, folder, settle):
+        self.folder = folder
+        self.settle = settle
+        # entry: (signature, monotonic time of last change)
+        self.snapshots = {}
+        # entry: signature, processed already, skip until changed
+        self.ignored = {}
+
+    def get_signature(self, entry):
+        """ size and mtime of all files in entry """
+        entry_path = os.path.join(self.folder, entry)
+        if os.path.isfile(entry_path):
+            stat = os.stat(entry_path)
+            return ((entry, stat.st_size, stat.st_mtime_ns),)
+        signature = []
+        for file_entry in Scanner.walk(entry_path):
+            try:
+                stat = file_entry.stat()
+            except FileNotFoundError:
+                continue
+            signature.append(
+                (file_entry.path, stat.st_size, stat.st_mtime_ns)
+            )
+        return tuple(sorted(signature))
+
+    def get_folders(self):
+        """ all folders to add to inotify """
+        folders = [self.folder]
+        for dirpath, dirnames, _ in os.walk(self.folder):
+            folders.extend(os.path.join(dirpath, i) for i in dirnames)
+        return folders
+
+    def get_stable(self):
+        """ return entries unchanged for at least settle seconds """
+        now = monotonic()
+        entries = os.listdir(self.folder)
+        stable = []
+        for entry in entries:
+            try:
+                signature = self.get_signature(entry)
+            except FileNotFoundError:
+                continue
+            if self.ignored.get(entry) == signature:
+                continue
+            self.ignored.pop(entry, None)
+            last = self.snapshots.get(entry)
+            if not last or last[0] != signature:
+                self.snapshots[entry] = (signature, now)
+            elif now - last[1] >= self.settle:
+                stable.append(entry)
+        # forget vanished
+        for entry in set(self.snapshots) - set(entries):
+            self.snapshots.pop(entry)
+        return stable
+
+    def ignore(self, entries):
+        """ entries still there after processing get skipped until changed """
+        for entry in entries:
+            try:
+                self.ignored[entry] = self.get_signature(entry)
+            except FileNotFoundError:
+                continue
+
+
+class Daemon:
+    """ sort tv and movie downloads as soon as they are complete """
+
+    CONFIG = get_config()
+
+    def __init__(self, interval=10, settle=60):
+        self.interval = interval
+        tv_downpath = self.CONFIG['media']['tv_downpath']
+        movie_downpath = self.CONFIG['media']['movie_downpath']
+        self.watches = {
+            'sort-tv': (FolderWatch(tv_downpath, settle), tvsort.main),
+            'sort-movies': (
+                FolderWatch(movie_downpath, settle), moviesort.main
+            )
+        }
+        self.inotify = Inotify()
+
+    def run(self):
+        """ loop forever """
+        if self.inotify.fd is None:
+            print('inotify not available, polling', file=sys.stderr)
+        while True:
+            for watch, _ in self.watches.values():
+                for folder in watch.get_folders():
+                    self.inotify.add_watch(folder)
+            self.run_once()
+            self.inotify.wait(self.interval)
+
+    def run_once(self):
+        """ process all stable entries, return summary dict """
+        # pylint: disable=broad-except
+        summary = {'results': {}, 'errors': {}}
+        for task, (watch, task_main) in self.watches.items():
+            stable = watch.get_stable()
+            if not stable:
+                continue
+            Batch.deferred = []
+            try:
+                # keep stdout for the summary
+                with redirect_stdout(sys.stderr):
+                    summary['results'][task] = task_main(stable)
+            except Exception as err:
+                logging.exception('watch:%s failed', task)
+                summary['errors'][task] = repr(err)
+            # deferred files get moved back to the download folder
+            deferred = [i['filename'] for i in Batch.deferred]
+            watch.ignore(stable + deferred)
+            if Batch.deferred:
+                summary['deferred'] = len(Batch.deferred)
+                summary['review_file'] = Batch.write_review()
+        if summary['results'] or summary['errors']:
+            print(json.dumps(summary), flush=True)
+        return summary